@@ -1,19 +1,32 @@
-from fastapi import FastAPI, BackgroundTasks, Header, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional, Union
-from .video_generator import generate_video
+from fastapi import FastAPI, BackgroundTasks, Header, HTTPException, Request
+import msgspec
+from .models import VideoRequest
 from .webhook_sender import send_webhook
 import logging
 import os
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import asyncio
+import json
+import random
+import re
+import time
+import uuid
+import httpx
 from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from arq import create_pool
+from arq.connections import RedisSettings
+
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
 
 app = FastAPI()
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.environ.get('J2V_LOG', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Configure CORS
 app.add_middleware(
@@ -24,80 +37,231 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-class Animation(BaseModel):
-    easing: str
-    type: str
-    fade: bool
-    scope: str
-    end_scale: str
-    start_scale: str
-
-class SubElement(BaseModel):
-    id: str
-    type: str
-    name: Optional[str] = None
-    track: Optional[int] = None
-    time: Optional[float] = None
-    duration: Optional[float] = None
-    source: Optional[str] = None
-    x: Optional[str] = None
-    y: Optional[str] = None
-    width: Optional[str] = None
-    height: Optional[str] = None
-    x_anchor: Optional[str] = None
-    y_anchor: Optional[str] = None
-    fill_color: Optional[str] = None
-    text: Optional[str] = None
-    font_family: Optional[str] = None
-    font_size: Optional[str] = None
-
-class Element(SubElement):
-    elements: Optional[List[SubElement]] = None
-
-class VideoRequest(BaseModel):
-    output_format: str
-    width: int
-    height: int
-    duration: float
-    snapshot_time: Optional[float] = None
-    elements: List[Union[SubElement, Element]]
-
-# Create a ProcessPoolExecutor with a maximum of 2 workers
-process_pool = ProcessPoolExecutor(max_workers=2)
+def load_video_generator():
+    # MoviePy and its imaging stack are imported only where videos are rendered,
+    # not in the API process that just validates and queues requests
+    from . import video_generator
+    return video_generator
+
+def prefetch_batch(json_datas: list):
+    return load_video_generator().prefetch_batch(json_datas)
+
+def generate_video(json_data: dict):
+    return load_video_generator().generate_video(json_data)
+
+# Renders run in separate processes, since MoviePy frame making is GIL-bound; RENDER_WORKERS
+# is also read by video_generator to split the cores between concurrent FFmpeg encodes, so
+# it must be the number of renders on the whole host: run a single API process
+RENDER_WORKERS = max(1, int(os.environ.get('RENDER_WORKERS', 2)))
+
+# Create a ProcessPoolExecutor with RENDER_WORKERS workers, importing MoviePy once per worker
+process_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, initializer=load_video_generator)
+
+# When set, jobs are queued to long-lived arq workers (see app/worker.py) instead of the local pool
+REDIS_URL = os.environ.get('REDIS_URL')
+
+# Shared client so webhook deliveries reuse keep-alive connections
+http_client = None
+
+def init_http_client():
+    global http_client
+    http_client = httpx.AsyncClient(
+        timeout=30,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+
+async def close_http_client():
+    if http_client:
+        await http_client.aclose()
+
+# Limits concurrent renders on GPU hosts; None when no NVIDIA GPU is present
+gpu_semaphore = None
+
+def init_gpu_semaphore():
+    """
+    Sizes the render semaphore from free GPU memory: one render per free GiB, capped at 2
+    because consumer NVIDIA cards only allow 2-3 concurrent NVENC sessions.
+
+    The semaphore is per process, so the cap only holds for the whole host with a single
+    API process (see the Dockerfile CMD) or a single arq worker.
+    """
+    global gpu_semaphore
+    if pynvml is None:
+        return
+    try:
+        pynvml.nvmlInit()
+        try:
+            handle = pynvml.nvmlDeviceGetHandleByIndex(0)
+            free_mb = pynvml.nvmlDeviceGetMemoryInfo(handle).free / 2**20
+        finally:
+            pynvml.nvmlShutdown()
+    except pynvml.NVMLError as e:
+        logging.info(f"No NVIDIA GPU available, renders are not GPU-limited: {e}")
+        return
+    slots = max(1, min(2, int(free_mb // 1024)))
+    gpu_semaphore = asyncio.Semaphore(slots)
+    logging.info(f"GPU has {free_mb:.0f} MB free; allowing {slots} concurrent renders")
+
+@app.on_event("startup")
+async def startup():
+    init_gpu_semaphore()
+    init_http_client()
+    app.state.arq = await create_pool(RedisSettings.from_dsn(REDIS_URL)) if REDIS_URL else None
+    if app.state.arq:
+        logging.info("Queueing video generation jobs to arq workers")
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_http_client()
+    if app.state.arq:
+        await app.state.arq.close()
+
+@lru_cache(maxsize=256)
+def _validate_request(raw_body: bytes) -> dict:
+    # Clients often resubmit identical specs, so validated bodies are cached by content.
+    # The returned dict is shared between cache hits and must not be mutated.
+    # strict=False keeps accepting numeric strings such as "1.5" for numeric fields
+    return msgspec.to_builtins(msgspec.json.decode(raw_body, type=VideoRequest, strict=False))
+
+# msgspec reports where validation failed as a JSON path, e.g. "... - at `$.elements[0].width`"
+_ERROR_PATH = re.compile(r" - at `\$(.*)`$")
+_PATH_PART = re.compile(r"\.([^.\[]+)|\[(\d+)\]")
+
+def _error_detail(error: msgspec.DecodeError) -> list:
+    # Same shape as FastAPI's own validation errors, so clients can keep parsing detail[]
+    message = str(error)
+    loc = ["body"]
+    match = _ERROR_PATH.search(message)
+    if match:
+        message = message[:match.start()]
+        for key, index in _PATH_PART.findall(match.group(1)):
+            loc.append(int(index) if index else key)
+    if isinstance(error, msgspec.ValidationError):
+        error_type = "value_error"
+    else:
+        error_type = "value_error.jsondecode"
+    return [{"loc": loc, "msg": message, "type": error_type}]
+
+WEBHOOK_ATTEMPTS = 5
+# Webhooks that could not be delivered are written here for manual replay
+DEAD_LETTER_DIR = os.environ.get('DEAD_LETTER_DIR', '/tmp/j2v_dead_letters')
+
+def _is_retryable(error: Exception) -> bool:
+    # Client errors will not succeed on retry, except request timeouts and rate limiting
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status in (408, 429)
+    return True
+
+def _dead_letter(webhook_url: str, payload, error: Exception):
+    os.makedirs(DEAD_LETTER_DIR, exist_ok=True)
+    path = os.path.join(DEAD_LETTER_DIR, f"{uuid.uuid4()}.json")
+    with open(path, 'w') as f:
+        json.dump({"webhook_url": webhook_url, "payload": payload, "error": str(error), "time": time.time()}, f)
+    logging.error(f"Webhook to {webhook_url} undeliverable; saved to {path}")
+
+async def deliver_webhook(webhook_url: str, payload):
+    for attempt in range(WEBHOOK_ATTEMPTS):
+        try:
+            await send_webhook(http_client, webhook_url, payload)
+            return
+        except Exception as e:
+            logging.error(f"Error sending webhook (attempt {attempt + 1}/{WEBHOOK_ATTEMPTS}): {str(e)}")
+            if not _is_retryable(e) or attempt == WEBHOOK_ATTEMPTS - 1:
+                _dead_letter(webhook_url, payload, e)
+                return
+            # Exponential backoff with jitter so a recovering receiver is not hit by synchronized retries
+            await asyncio.sleep(min(60, 2 ** attempt) + random.uniform(0, 1))
 
 @app.post("/generate_video")
-async def create_video(request: VideoRequest, background_tasks: BackgroundTasks, x_webhook_url: str = Header(...)):
+async def create_video(request: Request, background_tasks: BackgroundTasks, x_webhook_url: str = Header(...)):
     logging.info("Received video generation request")
-    background_tasks.add_task(process_video_request_with_timeout, request.dict(), x_webhook_url)
+    try:
+        json_data = _validate_request(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=_error_detail(e))
+    if app.state.arq:
+        await app.state.arq.enqueue_job('generate_video_task', json_data, x_webhook_url)
+    else:
+        background_tasks.add_task(process_video_request_with_timeout, json_data, x_webhook_url)
     return {"message": "Video generation started"}
 
-async def process_video_request_with_timeout(json_data: dict, webhook_url: str):
+# Requests arriving within BATCH_WINDOW seconds whose sources overlap at least
+# BATCH_SIMILARITY (Jaccard index) are batched, downloading shared sources once before
+# their renders run side by side on the pool
+BATCH_WINDOW = 0.25
+BATCH_SIMILARITY = 0.5
+_pending_batches = []
+
+def _sources(json_data: dict) -> frozenset:
+    return frozenset(element['source'] for element in json_data.get('elements', []) if element.get('source'))
+
+def _similarity(a: frozenset, b: frozenset) -> float:
+    union = a | b
+    return len(a & b) / len(union) if union else 0.0
+
+async def _render_one(json_data: dict, future, executor):
+    loop = asyncio.get_event_loop()
     try:
         # Use ProcessPoolExecutor to run the CPU-intensive task
+        if gpu_semaphore:
+            # Held until generate_video returns, i.e. until the encode has finished
+            async with gpu_semaphore:
+                video_url = await loop.run_in_executor(executor, generate_video, json_data)
+        else:
+            video_url = await loop.run_in_executor(executor, generate_video, json_data)
+    except Exception as e:
+        future.set_exception(e)
+        return
+    future.set_result(video_url)
+
+async def _run_batch(batch: dict, executor):
+    _pending_batches.remove(batch)
+    jobs = batch['jobs']
+    if len(jobs) > 1:
+        # Shared sources are downloaded once before the renders start; each render
+        # still fetches whatever is missing, so a failed prefetch only costs time
         loop = asyncio.get_event_loop()
-        video_url = await loop.run_in_executor(process_pool, generate_video, json_data)
-        
+        try:
+            await loop.run_in_executor(executor, prefetch_batch, [json_data for json_data, _ in jobs])
+        except Exception as e:
+            logging.warning(f"Prefetching batch sources failed: {str(e)}")
+    # Each render runs on its own pool worker and resolves its request as soon as it finishes
+    await asyncio.gather(*(_render_one(json_data, future, executor) for json_data, future in jobs))
+
+async def render_video(json_data: dict, executor=process_pool):
+    """
+    Renders a video, batched with other requests arriving shortly after that share its sources.
+    """
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+    sources = _sources(json_data)
+    for batch in _pending_batches:
+        if _similarity(sources, batch['sources']) >= BATCH_SIMILARITY:
+            batch['sources'] |= sources
+            batch['jobs'].append((json_data, future))
+            break
+    else:
+        batch = {'sources': sources, 'jobs': [(json_data, future)]}
+        _pending_batches.append(batch)
+        loop.call_later(BATCH_WINDOW, lambda: asyncio.ensure_future(_run_batch(batch, executor)))
+    return await future
+
+async def process_video_request_with_timeout(json_data: dict, webhook_url: str, executor=process_pool):
+    try:
+        video_url = await render_video(json_data, executor)
+
         if video_url:
             logging.info(f"Video generated successfully. URL: {video_url}")
-            retry_count = 3
-            while retry_count > 0:
-                try:
-                    send_webhook(webhook_url, video_url)
-                    logging.info("Webhook sent successfully")
-                    break
-                except Exception as e:
-                    logging.error(f"Error sending webhook (attempt {4-retry_count}/3): {str(e)}")
-                    retry_count -= 1
-                    if retry_count == 0:
-                        logging.error("Failed to send webhook after 3 attempts")
+            await deliver_webhook(webhook_url, video_url)
         else:
             logging.error("Video generation failed; webhook not sent.")
     except asyncio.TimeoutError:
         logging.error("Video generation timed out")
-        send_webhook(webhook_url, {"error": "Video generation timed out"})
+        await deliver_webhook(webhook_url, {"error": "Video generation timed out"})
     except Exception as e:
         logging.error(f"Error in video generation process: {str(e)}")
-        send_webhook(webhook_url, {"error": str(e)})
+        await deliver_webhook(webhook_url, {"error": str(e)})
 
 @app.get("/")
 async def root():
@@ -105,4 +269,7 @@ async def root():
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    if os.environ.get("ENV") == "production":
+        uvicorn.run(app, host="0.0.0.0", port=port, log_level="warning")
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=port, log_level="debug")
@@ -0,0 +1,50 @@
+import msgspec
+from typing import List, Optional, Union
+
+# Positions and sizes may be given as strings ("50%", "7 vmin") or plain numbers
+Dimension = Union[str, float]
+
+class Animation(msgspec.Struct, omit_defaults=True, gc=False):
+    easing: str
+    type: str
+    fade: bool
+    scope: str
+    end_scale: str
+    start_scale: str
+
+class SubElement(msgspec.Struct, omit_defaults=True, gc=False):
+    id: str
+    type: str
+    name: Optional[str] = None
+    track: Optional[int] = None
+    time: Optional[float] = None
+    duration: Optional[float] = None
+    source: Optional[str] = None
+    x: Optional[Dimension] = None
+    y: Optional[Dimension] = None
+    width: Optional[Dimension] = None
+    height: Optional[Dimension] = None
+    x_anchor: Optional[Dimension] = None
+    y_anchor: Optional[Dimension] = None
+    fill_color: Optional[str] = None
+    text: Optional[str] = None
+    font_family: Optional[str] = None
+    font_size: Optional[Dimension] = None
+
+class Element(SubElement):
+    elements: Optional[List[SubElement]] = None
+
+class VideoRequest(msgspec.Struct, omit_defaults=True, gc=False):
+    output_format: str
+    width: int
+    height: int
+    duration: float
+    elements: List[Element]
+    snapshot_time: Optional[float] = None
+    # Presigned URL the finished video is PUT to with a Content-Length; the webhook then
+    # receives its object URL
+    upload_url: Optional[str] = None
+    # Stream the video to upload_url while it is encoded instead of rendering it to a file
+    # first. The PUT is then sent with Transfer-Encoding: chunked, which many presigned URLs
+    # (e.g. S3's) reject, so only set this for upload servers known to accept chunked bodies.
+    stream_upload: bool = False
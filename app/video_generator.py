@@ -1,8 +1,12 @@
 import json
 import os
+import re
 import uuid
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import tempfile
+import shutil
 from io import BytesIO
 
 import numpy as np
@@ -25,6 +29,7 @@ import math
 import logging
 import imageio
 from moviepy.video.VideoClip import VideoClip
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
 import gc
 import psutil  # Make sure this line is present
 from fontTools.ttLib import TTFont
@@ -32,6 +37,23 @@ import subprocess
 from moviepy.config import change_settings
 import stat
 import multiprocessing
+import functools
+import time
+import queue
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
 
 # Set the ImageMagick binary path
 magick_home = os.environ.get('MAGICK_HOME', '/usr')
@@ -44,137 +66,478 @@ else:
     logging.warning(f"ImageMagick binary not found at {imagemagick_binary}. Using default.")
 
 # Configure logging at the beginning of your script
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.environ.get('J2V_LOG', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
 
 DEBUG = os.environ.get('DEBUG', '0') == '1'
 
+# Downloaded sources are cached on disk, keyed by URL, and evicted least recently used first
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'j2v_cache'))
+MAX_CACHE_BYTES = int(os.environ.get('MAX_CACHE_BYTES', 1024 * 1024 * 1024))
+# Cached downloads older than this many seconds are revalidated against the server
+CACHE_MAX_AGE = float(os.environ.get('CACHE_MAX_AGE', 24 * 60 * 60))
+CACHE_META_SUFFIX = '.meta'
+
+# Buffer size of the pipe raw frames are written to FFmpeg through
+FRAME_PIPE_BUFFER = 1 << 20
+
+# Elements built between garbage collections in generate_video
+GC_INTERVAL = 8
+
+# Renders running side by side (the API's process pool or arq's max_jobs); each FFmpeg
+# encode gets an equal share of the cores so concurrent encodes do not oversubscribe them.
+# This assumes RENDER_WORKERS is the host-wide number of renders, i.e. a single API process
+# (the Dockerfile runs one uvicorn worker) or a single arq worker per host.
+RENDER_WORKERS = max(1, int(os.environ.get('RENDER_WORKERS', 2)))
+ENCODE_THREADS = max(1, multiprocessing.cpu_count() // RENDER_WORKERS)
+
+# This process, for memory usage logging; the module is imported in each render process
+_process = psutil.Process(os.getpid())
+
+# Shared pool for fetching assets concurrently; kept at module level to avoid per-request pool startup
+DOWNLOAD_WORKERS = 32
+_download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+
+# Downloads are streamed to disk in chunks of this size rather than buffered in memory
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Renders hardlink the cached files they use into their own directory under PIN_DIR;
+# eviction skips files with more than one link, so nothing is removed mid-render.
+# Pin directories left behind by crashed renders are removed after PIN_MAX_AGE seconds.
+PIN_DIR = os.path.join(CACHE_DIR, 'pins')
+PIN_MAX_AGE = 60 * 60
+
+# (connect, read) timeouts in seconds, so a stalled server fails the download instead of hanging the render
+DOWNLOAD_TIMEOUT = (5, 30)
+
+# (connect, read) timeouts in seconds for uploading the rendered video, so a stalled
+# upload fails the render instead of blocking the worker forever
+UPLOAD_TIMEOUT = (10, 300)
+
+# Pooled HTTP connections, sized so every download worker can keep one open; connection
+# errors and transient server errors are retried with backoff before a download fails
+_http_retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+_http_session = requests.Session()
+_http_session.mount('http://', HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS, max_retries=_http_retry))
+_http_session.mount('https://', HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS, max_retries=_http_retry))
+
+# Hardware H.264 encoders in order of preference; libx264 is the software fallback.
+HW_ENCODERS = ['h264_nvenc', 'h264_qsv', 'h264_videotoolbox', 'h264_amf']
+SOFTWARE_ENCODER = 'libx264'
+
+# Encoder specific FFmpeg parameters. B-frames are enabled to match x264's default of 3.
+ENCODER_PARAMS = {
+    'h264_nvenc': ["-preset", "p4", "-tune", "hq", "-rc", "vbr", "-cq", "23", "-b:v", "6M", "-bf", "3"],
+    'h264_qsv': ["-preset", "faster", "-global_quality", "23", "-bf", "3"],
+    'h264_videotoolbox': ["-b:v", "6M", "-bf", "3"],
+    'h264_amf': ["-quality", "speed", "-rc", "vbr_peak", "-b:v", "6M", "-bf", "3"],
+    # Files are encoded offline, so x264 uses frame threads and B-frames rather than
+    # low-latency settings, and quality-based rate control without a rate cap
+    'libx264': ["-preset", "veryfast", "-crf", "23", "-tune", "fastdecode", "-bf", "3"],
+}
+
+# Override the libx264 parameters when the output is streamed to the upload URL as it is encoded
+STREAMING_X264_PARAMS = ["-tune", "fastdecode,zerolatency", "-bf", "0"]
+
+
+def encoder_params(encoder, streaming=False):
+    """
+    Returns the FFmpeg parameters for an encoder.
+
+    Args:
+        encoder (str): The FFmpeg encoder name.
+        streaming (bool): Whether the output is consumed while it is encoded, in which
+            case libx264 also minimizes latency.
+
+    Returns:
+        list: The parameters.
+    """
+    if streaming and encoder == SOFTWARE_ENCODER:
+        # Later options override earlier ones
+        return ENCODER_PARAMS[encoder] + STREAMING_X264_PARAMS
+    return ENCODER_PARAMS[encoder]
+
+
+@functools.lru_cache(maxsize=1)
+def _detect_encoder():
+    """
+    Detects the fastest usable H.264 encoder.
+
+    The encoders compiled into FFmpeg are listed once and each hardware candidate is
+    verified with a tiny test encode, since an encoder can be built in without the
+    matching device being present. The result is cached for the life of the process.
+    Setting J2V_ENCODER skips detection, for deployments that know their hardware.
+
+    Returns:
+        str: The name of the encoder to use.
+    """
+    override = os.environ.get('J2V_ENCODER')
+    if override in ENCODER_PARAMS:
+        logging.info(f"Using encoder from J2V_ENCODER: {override}")
+        return override
+    if override:
+        logging.warning(f"Ignoring unsupported J2V_ENCODER {override}")
+
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-encoders'],
+            capture_output=True, text=True, timeout=10
+        )
+        available = result.stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.warning(f"Could not list FFmpeg encoders, using {SOFTWARE_ENCODER}: {e}")
+        return SOFTWARE_ENCODER
+
+    for encoder in HW_ENCODERS:
+        if encoder not in available:
+            continue
+        try:
+            probe = subprocess.run(
+                ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+                 '-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1',
+                 '-c:v', encoder, '-f', 'null', '-'],
+                capture_output=True, timeout=10
+            )
+        except (OSError, subprocess.SubprocessError):
+            continue
+        if probe.returncode == 0:
+            logging.info(f"Using hardware encoder: {encoder}")
+            return encoder
+
+    logging.info(f"No hardware encoder available, using {SOFTWARE_ENCODER}")
+    return SOFTWARE_ENCODER
+
+
+@functools.lru_cache(maxsize=1)
+def _detect_hwaccel():
+    """
+    Detects whether CUDA (NVDEC) hardware decoding can be used.
+
+    CUDA decoding is only enabled when FFmpeg lists the cuda hwaccel and NVENC passed
+    its test encode, which proves an NVIDIA device is actually present.
+
+    Returns:
+        str or None: "cuda" if hardware decoding is available, None otherwise.
+    """
+    if _detect_encoder() != 'h264_nvenc':
+        return None
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-hwaccels'],
+            capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.warning(f"Could not list FFmpeg hwaccels: {e}")
+        return None
+    if 'cuda' in result.stdout.split():
+        logging.info("Using CUDA hardware decoding for video sources")
+        return 'cuda'
+    return None
+
+
+# Probe the encoder and decoder once at import, when a render process warms up, rather than on its first render
+_detect_hwaccel()
+
+
+def _evict_cache():
+    """
+    Removes the least recently used files until the download cache fits MAX_CACHE_BYTES.
+    """
+    try:
+        entries = [
+            entry for entry in os.scandir(CACHE_DIR)
+            if entry.is_file() and not entry.name.endswith(('.part', CACHE_META_SUFFIX))
+        ]
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    total_size = sum(entry.stat().st_size for entry in entries)
+    _sweep_stale_pins()
+    for entry in entries:
+        if total_size <= MAX_CACHE_BYTES:
+            break
+        try:
+            # A second link means a render in this or another process has pinned the file
+            if os.stat(entry.path).st_nlink > 1:
+                continue
+            size = entry.stat().st_size
+            os.unlink(entry.path)
+            total_size -= size
+            logging.info(f"Evicted cached download: {entry.path}")
+        except FileNotFoundError:
+            pass
+        try:
+            os.unlink(entry.path + CACHE_META_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+
+def create_pin_dir():
+    """
+    Creates the directory a render pins the cached files it uses into.
+
+    Returns:
+        str: The pin directory, to be removed with release_pin_dir when the render ends.
+    """
+    os.makedirs(PIN_DIR, exist_ok=True)
+    return tempfile.mkdtemp(dir=PIN_DIR)
+
+
+def pin_file(path, pin_dir):
+    """
+    Protects a cached file from eviction by hardlinking it into a render's pin directory.
+
+    The render keeps using the cache path, so memoized probes and decodes still apply.
+
+    Args:
+        path (str): Path to the cached file.
+        pin_dir (str): The render's directory from create_pin_dir.
+
+    Returns:
+        bool: False if the file was evicted before it could be pinned.
+    """
+    try:
+        os.link(path, os.path.join(pin_dir, os.path.basename(path)))
+    except FileExistsError:
+        pass
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        # e.g. a filesystem without hard links; the file is merely unprotected
+        logging.warning(f"Could not pin cached download {path}: {e}")
+    return True
+
+
+def release_pin_dir(pin_dir):
+    """
+    Unpins the files of a finished render, making them evictable again.
+    """
+    shutil.rmtree(pin_dir, ignore_errors=True)
+
+
+def _sweep_stale_pins():
+    # Pins of renders that crashed before releasing them would keep files cached forever
+    try:
+        entries = list(os.scandir(PIN_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if time.time() - entry.stat().st_mtime > PIN_MAX_AGE:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+
+def _read_cache_meta(cache_path):
+    """
+    Reads the validators stored next to a cached download, or an empty dict if there are none.
+    """
+    try:
+        with open(cache_path + CACHE_META_SUFFIX) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache_meta(cache_path, etag, last_modified):
+    """
+    Stores a cached download's ETag and Last-Modified validators and when they were last checked.
+    """
+    meta = {'etag': etag, 'last_modified': last_modified, 'validated': time.time()}
+    temp_path = f"{cache_path}{CACHE_META_SUFFIX}.{uuid.uuid4().hex}.part"
+    with open(temp_path, 'w') as file:
+        json.dump(meta, file)
+    os.replace(temp_path, cache_path + CACHE_META_SUFFIX)
+
+
 def download_file(url, suffix=''):
     """
-    Downloads a file from the specified URL to a temporary file.
+    Downloads a file from the specified URL into the content-addressed download cache.
+
+    Files are named after the SHA-256 of the URL, so assets reused across requests
+    (fonts, logos, background videos) are only fetched once. Cache hits refresh the
+    file's modification time, which drives least-recently-used eviction. Hits older
+    than CACHE_MAX_AGE are revalidated with the server's ETag or Last-Modified and
+    re-downloaded only if the asset changed; if the server is unreachable the cached
+    copy is used.
 
     Args:
         url (str): The URL to download the file from.
-        suffix (str): The suffix for the temporary file.
+        suffix (str): The suffix for the cached file.
 
     Returns:
-        str: The path to the downloaded temporary file.
+        str: The path to the cached file, which callers must not delete.
     """
+    cache_path = os.path.join(CACHE_DIR, hashlib.sha256(url.encode()).hexdigest() + suffix)
+    headers = {}
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                temp_file.write(chunk)
-        temp_file.close()
-        
-        # Set permissions to be readable and writable by all users
-        os.chmod(temp_file.name, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
-        
-        return temp_file.name
+        os.utime(cache_path)
+        cached = True
+    except FileNotFoundError:
+        # Not cached, or evicted by another render just now; either way, download it
+        cached = False
+    if cached:
+        meta = _read_cache_meta(cache_path)
+        stale = time.time() - meta.get('validated', 0) > CACHE_MAX_AGE
+        if not stale or not (meta.get('etag') or meta.get('last_modified')):
+            logging.info(f"Using cached download for {url}: {cache_path}")
+            return cache_path
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with _http_session.get(url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:
+            if cached and response.status_code == 304:
+                _write_cache_meta(cache_path, meta.get('etag'), meta.get('last_modified'))
+                logging.info(f"Cached download for {url} is still current: {cache_path}")
+                return cache_path
+            response.raise_for_status()
+            # Write to a unique partial file and rename atomically so concurrent downloads never see half a file
+            temp_file = tempfile.NamedTemporaryFile(delete=False, dir=CACHE_DIR, suffix='.part')
+            try:
+                # Copy straight from the socket in C-level chunks instead of a Python
+                # iter_content loop; urllib3 still undoes any Content-Encoding
+                response.raw.decode_content = True
+                shutil.copyfileobj(response.raw, temp_file, length=DOWNLOAD_CHUNK_SIZE)
+                temp_file.close()
+
+                # Set permissions to be readable and writable by all users
+                os.chmod(temp_file.name, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
+                os.replace(temp_file.name, cache_path)
+            except Exception:
+                temp_file.close()
+                os.unlink(temp_file.name)
+                raise
+            _write_cache_meta(cache_path, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+        _evict_cache()
+        return cache_path
     except Exception as e:
+        if cached:
+            logging.warning(f"Could not revalidate {url}, using cached download: {e}")
+            return cache_path
         logging.error(f"Error downloading file from {url}: {e}")
         return None
 
 
-def parse_percentage(value, total, video_height=None):
+def local_path(url, suffix='', source_paths=None):
     """
-    Parses a percentage string or vmin value and converts it to an absolute value.
+    Returns the local copy of a source, preferring one already fetched by prefetch_sources.
+
+    A source whose prefetch failed is not downloaded again, so a broken font or image
+    URL shared by many elements costs one failed download rather than one per element.
 
     Args:
-        value (str or int or float): The value to parse (e.g., "50%", "7 vmin", 100).
-        total (int): The total value to calculate the percentage against.
-        video_height (int): The height of the video, used for vmin calculations.
+        url (str): The source URL.
+        suffix (str): The suffix for the cached file.
+        source_paths (dict): Paths by (url, suffix) from prefetch_sources, or None.
 
     Returns:
-        int: The absolute value.
+        str or None: The path to the cached file or None if the download failed.
     """
-    if isinstance(value, (int, float)):
-        return int(value)
-    if isinstance(value, str):
-        value = value.strip().lower()
-        if value.endswith('%'):
-            try:
-                percentage = float(value.rstrip('%'))
-                percentage = max(0, min(percentage, 100))  # Clamp between 0% and 100%
-                return int((percentage / 100) * total)
-            except ValueError:
-                logging.error(f"Invalid percentage value: {value}")
-        elif 'vmin' in value:
-            try:
-                vmin_value = float(value.replace('vmin', '').strip())
-                if video_height is None:
-                    logging.error("Video height is required for vmin calculations")
-                    return 0
-                return int((vmin_value / 100) * video_height)
-            except ValueError:
-                logging.error(f"Invalid vmin value: {value}")
-    logging.error(f"Invalid value for parsing: {value}")
-    return 0
+    if source_paths and (url, suffix) in source_paths:
+        path = source_paths[(url, suffix)]
+        if path is None:
+            return None
+        # The prefetched copy may since have been evicted by another render's download
+        if os.path.exists(path):
+            return path
+    return download_file(url, suffix=suffix)
 
 
-def parse_size(size_str, reference_size, video_width, video_height):
+def is_gif_file(path):
     """
-    Parses size strings which can be percentages or absolute values.
+    Checks whether a file is a GIF by its magic bytes, since source URLs often carry no extension.
 
     Args:
-        size_str (str or int or float): The size string to parse.
-        reference_size (int): The reference size (width or height).
-        video_width (int): The width of the video.
-        video_height (int): The height of the video.
+        path (str): Path to the file.
 
     Returns:
-        int or None: The parsed size in pixels or None if invalid.
+        bool: True if the file is a GIF.
     """
-    if size_str is None:
-        return None
-    if isinstance(size_str, (int, float)):
-        return max(0, min(int(size_str), reference_size))
-    if isinstance(size_str, str):
-        size_str = size_str.strip().lower()
-        if size_str.endswith('%'):
-            return parse_percentage(size_str, reference_size)
-        elif size_str.endswith('vmin'):
-            try:
-                vmin_value = float(size_str.rstrip('vmin').strip())
-                vmin = min(video_width, video_height)
-                vmin_value = max(0, min(vmin_value, 100))
-                return int((vmin_value / 100) * vmin)
-            except ValueError:
-                print(f"Invalid vmin value: {size_str}")
-        else:
-            try:
-                return max(0, min(int(float(size_str)), reference_size))
-            except ValueError:
-                print(f"Invalid size format: {size_str}")
-    return None
+    with open(path, 'rb') as file:
+        return file.read(6) in (b'GIF87a', b'GIF89a')
 
 
-def resize_clip(clip, target_width, target_height):
+def probe_media(path):
     """
-    Resizes the clip to cover the target dimensions while maintaining aspect ratio.
+    Reads a media file's metadata with FFmpeg, memoized per file.
+
+    Cached downloads are replaced atomically rather than rewritten, so the inode and
+    size identify the file's content; modification times are bumped on every cache hit.
 
     Args:
-        clip (VideoFileClip or ImageClip or ImageSequenceClip or TextClip): The clip to resize.
-        target_width (int): The target width in pixels.
-        target_height (int): The target height in pixels.
+        path (str): Path to the media file.
 
     Returns:
-        Clip: The resized clip.
+        dict: The infos returned by MoviePy's ffmpeg_parse_infos.
     """
-    original_ratio = clip.w / clip.h
-    target_ratio = target_width / target_height
+    info = os.stat(path)
+    return _probe_media(path, info.st_ino, info.st_size)
 
-    if original_ratio > target_ratio:
-        # Clip is wider than target: set height to target and scale width
-        new_height = target_height
-        new_width = int(new_height * original_ratio)
-    else:
-        # Clip is taller than target: set width to target and scale height
-        new_width = target_width
-        new_height = int(new_width / original_ratio)
 
-    return clip.resize(width=new_width, height=new_height)
+@functools.lru_cache(maxsize=256)
+def _probe_media(path, inode, size):
+    return ffmpeg_parse_infos(path)
+
+
+# A number with an optional unit, e.g. "50%", "7 vmin", "120px" or "120"
+_SIZE_RE = re.compile(r'^(-?(?:\d+\.?\d*|\.\d+))\s*(%|vmin|px|)$')
+
+
+@functools.lru_cache(maxsize=1024)
+def _split_size(value):
+    """
+    Splits a size string into its numeric value and unit.
+
+    Args:
+        value (str): The size string (e.g., "50%", "7 vmin").
+
+    Returns:
+        tuple or None: (value, unit) with unit one of "%", "vmin", "px" or "", or None if invalid.
+    """
+    match = _SIZE_RE.match(value.strip().lower())
+    if not match:
+        return None
+    return float(match.group(1)), match.group(2)
+
+
+# Converts (value, total, video_height) to pixels for each unit parse_percentage accepts
+_PERCENTAGE_UNITS = {
+    '%': lambda value, total, video_height: int((max(0, min(value, 100)) / 100) * total),  # Clamp between 0% and 100%
+    'vmin': lambda value, total, video_height: int((value / 100) * video_height),
+    'px': lambda value, total, video_height: int(value),
+    '': lambda value, total, video_height: int(value),
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_percentage(value, total, video_height=None):
+    """
+    Parses a percentage string or vmin value and converts it to an absolute value.
+
+    Args:
+        value (str or int or float): The value to parse (e.g., "50%", "7 vmin", 100).
+        total (int): The total value to calculate the percentage against.
+        video_height (int): The height of the video, used for vmin calculations.
+
+    Returns:
+        int: The absolute value.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    parsed = _split_size(value) if isinstance(value, str) else None
+    if parsed is None:
+        logging.error(f"Invalid value for parsing: {value}")
+        return 0
+    number, unit = parsed
+    if unit == 'vmin' and video_height is None:
+        logging.error("Video height is required for vmin calculations")
+        return 0
+    return _PERCENTAGE_UNITS[unit](number, total, video_height)
 
 
 def position_clip(clip, x, y):
@@ -192,12 +555,42 @@ def position_clip(clip, x, y):
     return clip.set_position((x, y))
 
 
-def create_audio_clip(element):
+def place_clip(clip, start, duration=None, position=None):
+    """
+    Sets a clip's timing and position in place.
+
+    MoviePy's set_start, set_duration and set_position each return a copy of the clip
+    (and of its mask and audio), so chaining them churns through clip objects.
+
+    Args:
+        clip (Clip): The clip to update, including its mask and audio.
+        start (float): The start time in seconds.
+        duration (float): The duration in seconds, or None to keep the current one.
+        position (tuple): The (x, y) position, or None to keep the current one.
+
+    Returns:
+        Clip: The same clip.
+    """
+    for part in (clip, getattr(clip, 'mask', None), getattr(clip, 'audio', None)):
+        if part is None:
+            continue
+        part.start = start
+        if duration is not None:
+            part.duration = duration
+        part.end = None if part.duration is None else start + part.duration
+    if position is not None:
+        clip.pos = lambda t: position
+        clip.relative_pos = False
+    return clip
+
+
+def create_audio_clip(element, source_paths=None):
     """
     Creates an audio clip from the provided element.
 
     Args:
         element (dict): The JSON element for the audio.
+        source_paths (dict): Prefetched paths from prefetch_sources, or None.
 
     Returns:
         AudioFileClip or None: The created audio clip or None if failed.
@@ -207,32 +600,34 @@ def create_audio_clip(element):
     duration = element.get('duration')
 
     if not source:
-        print(f"Audio element {element['id']} has no source.")
+        logging.error(f"Audio element {element['id']} has no source.")
         return None
 
-    temp_audio = download_file(source, suffix='.mp3')  # Assuming mp3, adjust if necessary
+    temp_audio = local_path(source, '.mp3', source_paths)  # Assuming mp3, adjust if necessary
     if not temp_audio:
         return None
 
     try:
-        audio_clip = AudioFileClip(temp_audio).set_start(start_time)
+        audio_clip = AudioFileClip(temp_audio)
         if duration:
             audio_clip = audio_clip.subclip(0, duration)
+        place_clip(audio_clip, start_time)
         volume = element.get('volume')
+        volume_value = 1.0
         if volume:
             try:
                 volume_value = float(volume.rstrip('%')) / 100
                 audio_clip = audio_clip.volumex(volume_value)
             except ValueError:
-                print(f"Invalid volume value for audio element: {element['id']}, using default volume.")
+                volume_value = 1.0
+                logging.warning(f"Invalid volume value for audio element: {element['id']}, using default volume.")
         audio_clip.name = element['id']
         audio_clip.track = element.get('track', 0)
+        audio_clip.ffmpeg_audio = {'path': temp_audio, 'duration': audio_clip.duration, 'volume': volume_value}
         return audio_clip
     except Exception as e:
-        print(f"Error creating audio clip for element {element['id']}: {e}")
+        logging.error(f"Error creating audio clip for element {element['id']}: {e}")
         return None
-    finally:
-        os.unlink(temp_audio)
 
 
 def process_gif_with_ffmpeg(gif_path, duration, output_path):
@@ -260,269 +655,1555 @@ def process_gif_with_ffmpeg(gif_path, duration, output_path):
         return False
 
 
-def create_image_clip(element, video_width, video_height):
-    source = element.get('source')
-    start_time = element.get('time', 0.0)
-    duration = element.get('duration')
-    repeat = element.get('repeat', False)
-    speed_factor = element.get('speed', 1.0)
+class FFmpegPipeReader:
+    """
+    Reads RGB frames of a video file from an FFmpeg subprocess.
+
+    Frames are read sequentially, which is how clips are rendered; seeking backwards or
+    far ahead restarts FFmpeg at the requested time. Sources can be looped endlessly,
+    sped up and resampled to a fixed frame rate by FFmpeg. With hwaccel="cuda" decoding runs
+    on NVDEC and only the decoded frames are copied to host memory. A background thread
+    reads up to PREFETCH_FRAMES frames ahead, so decoding overlaps compositing, reading
+    each frame from the unbuffered pipe straight into its own array. With alpha=True the
+    frames are RGBA, so transparent GIF pixels can be masked out.
+    """
 
-    if not source:
-        logging.error(f"Image/GIF element {element['id']} has no source.")
-        return None
+    PREFETCH_FRAMES = 8
+
+    def __init__(self, path, hwaccel=None, target_size=None, loop=False, speed=1.0, fps=None, alpha=False):
+        infos = probe_media(path)
+        self.path = path
+        self.hwaccel = hwaccel
+        self.channels = 4 if alpha else 3
+        self.scale = target_size is not None
+        self.size = tuple(target_size or infos['video_size'])
+        self.loop = loop
+        self.speed = speed
+        # Frames are resampled to a constant rate when one is given, e.g. for GIFs whose frame delays vary
+        self.resample = fps is not None
+        self.fps = fps or infos['video_fps']
+        self.duration = infos['video_duration']
+        self.has_audio = infos['audio_found']
+        self.proc = None
+        self.frames = None
+        self.thread = None
+        self.exhausted = False
+        self.pos = 0
+        self.last_frame = None
+
+    def _start(self, index):
+        self.close()
+        # Looped or retimed frames have their own timeline, so they are seeked in the output
+        retimed = self.loop or self.speed != 1.0 or self.resample
+        cmd = ['ffmpeg', '-loglevel', 'error']
+        if self.hwaccel:
+            cmd += ['-hwaccel', self.hwaccel]
+        if index and not retimed:
+            cmd += ['-ss', f"{index / self.fps:.6f}"]
+        if self.loop:
+            cmd += ['-stream_loop', '-1']
+        cmd += ['-i', self.path]
+        if index and retimed:
+            cmd += ['-ss', f"{index / self.fps:.6f}"]
+        filters = []
+        if self.speed != 1.0:
+            filters.append(f"setpts=PTS/{self.speed}")
+        if self.resample:
+            filters.append(f"fps={self.fps}")
+        if self.scale:
+            filters.append(f"scale={self.size[0]}:{self.size[1]}")
+        if filters:
+            cmd += ['-vf', ','.join(filters)]
+        cmd += ['-f', 'rawvideo', '-pix_fmt', 'rgba' if self.channels == 4 else 'rgb24', 'pipe:']
+        # Unbuffered, so frames are read straight from the pipe into their arrays
+        self.proc = subprocess.Popen(
+            cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0
+        )
+        self.frames = queue.Queue(maxsize=self.PREFETCH_FRAMES)
+        self.thread = threading.Thread(target=self._decode, args=(self.proc, self.frames), daemon=True)
+        self.thread.start()
+        self.exhausted = False
+        self.pos = index
+        self.last_frame = None
+
+    def _decode(self, proc, frames):
+        # Runs on the prefetch thread; None marks the end of the stream
+        width, height = self.size
+        while True:
+            frame = np.empty((height, width, self.channels), dtype=np.uint8)
+            buffer = memoryview(frame).cast('B')
+            filled = 0
+            while filled < len(buffer):
+                count = proc.stdout.readinto(buffer[filled:])
+                if not count:
+                    frames.put(None)
+                    return
+                filled += count
+            frames.put(frame)
+
+    def _read_frame(self):
+        if self.exhausted:
+            return False
+        frame = self.frames.get()
+        if frame is None:
+            self.exhausted = True
+            return False
+        self.last_frame = frame
+        self.pos += 1
+        return True
 
-    temp_image = download_file(source)
-    if not temp_image:
-        logging.error(f"Failed to download file from {source} for element {element['id']}.")
-        return None
+    def get_frame(self, t):
+        index = int(t * self.fps + 1e-5)
+        if self.proc is None or index < self.pos - 1 or index > self.pos + self.fps:
+            self._start(index)
+        while self.pos <= index:
+            if not self._read_frame():
+                break
+        if self.last_frame is None:
+            # Past the end of the stream: render black (or transparent) rather than failing the video
+            width, height = self.size
+            return np.zeros((height, width, self.channels), dtype=np.uint8)
+        return self.last_frame
+
+    def close(self):
+        if self.proc is not None:
+            self.proc.terminate()
+            # Unblock the prefetch thread if it is waiting on a full queue
+            while self.thread.is_alive():
+                try:
+                    self.frames.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.proc.stdout.close()
+            self.proc.wait()
+            self.proc = None
 
-    try:
-        if source.lower().endswith('.gif'):
-            # Handle GIF (existing GIF handling code remains the same)
-            gif = imageio.get_reader(temp_image)
-            frames = []
-            durations = []
-            for frame in gif:
-                frames.append(frame)
-                durations.append(frame.meta.get('duration', 100) / 1000)  # Convert to seconds
-
-            original_duration = sum(durations)
-            frame_count = len(frames)
-
-            if duration and repeat:
-                loop_count = math.ceil(duration / original_duration)
-                frames = frames * loop_count
-                durations = durations * loop_count
-                total_duration = loop_count * original_duration
-            else:
-                total_duration = original_duration
-
-            def make_frame(t):
-                t = (t * speed_factor) % total_duration
-                frame_index = 0
-                accumulated_time = 0
-                for i, d in enumerate(durations):
-                    if accumulated_time + d > t:
-                        frame_index = i
-                        break
-                    accumulated_time += d
-                return frames[frame_index % frame_count]
 
-            clip = VideoClip(make_frame, duration=duration or total_duration)
-        else:
-            # Handle static image (including transparent PNGs)
-            img = Image.open(temp_image)
-            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                img = img.convert('RGBA')
-                mask = np.array(img.split()[-1]) / 255.0
-                img_rgb = img.convert('RGB')
-                img_array = np.array(img_rgb)
-                clip = ImageClip(img_array).set_mask(ImageClip(mask, ismask=True))
-            else:
-                img = img.convert("RGB")
-                img_array = np.array(img)
-                clip = ImageClip(img_array)
+def decode_video(path, hwaccel=None, target_size=None, loop=False, speed=1.0, fps=None, alpha=False):
+    """
+    Creates a video clip whose frames are read from an FFmpeg pipe by FFmpegPipeReader.
 
-        # Set clip duration and start time
-        clip = clip.set_duration(duration or None).set_start(start_time)
+    Args:
+        path (str): Path to the video or GIF file.
+        hwaccel (str): FFmpeg hwaccel to decode with (e.g. "cuda"), or None to decode on the CPU.
+        target_size (tuple): Optional (width, height) FFmpeg scales the frames to.
+        loop (bool): Whether to loop the source endlessly.
+        speed (float): Playback speed factor.
+        fps (int): Optional constant frame rate to resample the frames to.
+        alpha (bool): Whether to decode the alpha channel (e.g. of GIFs) into the clip's mask.
 
-        # Handle animations
-        animations = element.get('animations', [])
-        if animations:
-            for anim in animations:
-                if anim['type'] == 'scale':
-                    # Adjust start_time and end_time based on the clip's start time
-                    anim_start_time = anim.get('time', 0)
-                    anim_end_time = anim_start_time + anim.get('duration', clip.duration)
-                    start_scale = parse_percentage(anim.get('start_scale', '100%'), 100) / 100
-                    end_scale = parse_percentage(anim.get('end_scale', '130%'), 100) / 100
-                    easing = anim.get('easing', 'linear')
-
-                    def scale_func(t):
-                        logging.info(f"Calculating scale for time {t}")
-                        if t < anim_start_time:
-                            return start_scale
-                        elif t > anim_end_time:
-                            return end_scale
-                        else:
-                            progress = (t - anim_start_time) / (anim_end_time - anim_start_time)
-                            if easing == 'quadratic-out':
-                                progress = 1 - (1 - progress) ** 2
-                            scale = start_scale + (end_scale - start_scale) * progress
-                            logging.info(f"Scale at time {t}: {scale}")
-                            return scale
-
-                    # Apply scaling using resize with updated scale_func
-                    clip = clip.resize(lambda t: scale_func(t))
-
-                    # Debugging: Verify animation parameters
-                    logging.info(f"Animation Start Time: {anim_start_time}, End Time: {anim_end_time}")
-                    logging.info(f"Start Scale: {start_scale}, End Scale: {end_scale}")
-                    logging.info(f"Easing: {easing}")
-
-        # Check if width, height, x, and y are specified
-        if all(element.get(attr) is None for attr in ['width', 'height', 'x', 'y']):
-            # If none are specified, make the image cover the entire video
-            aspect_ratio = clip.w / clip.h
-            video_aspect_ratio = video_width / video_height
-            
-            if aspect_ratio > video_aspect_ratio:
-                # Image is wider, fit to height
-                new_height = video_height
-                new_width = int(new_height * aspect_ratio)
-            else:
-                # Image is taller, fit to width
-                new_width = video_width
-                new_height = int(new_width / aspect_ratio)
-            
-            resized_clip = clip.resize(height=new_height, width=new_width)
-            x_offset = (video_width - new_width) // 2
-            y_offset = (video_height - new_height) // 2
-            final_clip = resized_clip.set_position((x_offset, y_offset))
-        else:
-            # Use the existing logic for resizing and positioning when dimensions are specified
-            target_width = parse_percentage(element.get('width', '100%'), video_width)
-            target_height = parse_percentage(element.get('height', '100%'), video_height)
-            
-            # Resize the clip to cover the target dimensions
-            aspect_ratio = clip.w / clip.h
-            target_ratio = target_width / target_height
-            
-            if aspect_ratio > target_ratio:
-                new_height = target_height
-                new_width = int(new_height * aspect_ratio)
-            else:
-                new_width = target_width
-                new_height = int(new_width / aspect_ratio)
-            
-            resized_clip = clip.resize(height=new_height, width=new_width)
-            
-            # Crop to fit the target dimensions
-            x_center = resized_clip.w / 2
-            y_center = resized_clip.h / 2
-            final_clip = resized_clip.crop(
-                x1=x_center - target_width / 2,
-                y1=y_center - target_height / 2,
-                width=target_width,
-                height=target_height
-            )
-            
-            # Position the clip
-            x_percentage = element.get('x', "0%")
-            y_percentage = element.get('y', "0%")
-            final_x = parse_percentage(x_percentage, video_width - final_clip.w)
-            final_y = parse_percentage(y_percentage, video_height - final_clip.h)
-            final_clip = final_clip.set_position((final_x, final_y))
+    Returns:
+        VideoClip: The clip, lasting one pass of the source. Its soundtrack is not opened;
+        audio_path names the source if it has one, for FFmpeg to mix.
+    """
+    reader = FFmpegPipeReader(path, hwaccel=hwaccel, target_size=target_size, loop=loop, speed=speed, fps=fps, alpha=alpha)
+    if alpha:
+        # The clip and its mask are sliced from the same RGBA frame; the reader returns its
+        # last frame again when the mask asks for the same time
+        clip = VideoClip(lambda t: reader.get_frame(t)[:, :, :3], duration=reader.duration)
+        clip.mask = VideoClip(
+            lambda t: np.multiply(reader.get_frame(t)[:, :, 3], 1.0 / 255.0, dtype=np.float32),
+            ismask=True, duration=reader.duration,
+        )
+        clip.mask.fps = reader.fps
+    else:
+        clip = VideoClip(reader.get_frame, duration=reader.duration)
+    clip.fps = reader.fps
+    clip.reader = reader
+    # An AudioFileClip would start an FFmpeg audio reader that the filter_complex path never
+    # uses, so MoviePy only opens the soundtrack if it has to mix it (see soundtrack_clips)
+    clip.audio_path = path if reader.has_audio else None
+    return clip
 
-        final_clip.name = element['id']
-        final_clip.track = element.get('track', 0)
 
-        logging.info(f"Created {'GIF' if source.lower().endswith('.gif') else 'image'} clip for element {element['id']} positioned at {final_clip.pos} with size {final_clip.w}x{final_clip.h}.")
-        return final_clip
+def cleanup_clip(clip):
+    """
+    Releases the FFmpeg readers of a clip and removes its intermediate render, if any.
 
+    Args:
+        clip (Clip): The clip to clean up.
+    """
+    try:
+        reader = getattr(clip, 'reader', None)
+        if isinstance(reader, FFmpegPipeReader):
+            reader.close()
+        if getattr(clip, 'audio', None) is not None:
+            clip.audio.close()
+        clip.close()
     except Exception as e:
-        logging.error(f"Error creating image/GIF clip for element {element['id']}: {e}")
-        return None
-    finally:
-        os.unlink(temp_image)
+        logging.warning(f"Error closing clip {getattr(clip, 'name', '')}: {e}")
+    # Intermediate renders are owned by the clip; downloaded sources belong to the cache
+    temp_file = getattr(clip, 'temp_file', None)
+    if temp_file and os.path.exists(temp_file):
+        os.unlink(temp_file)
 
 
-def create_text_clip(element, video_width, video_height, total_duration):
-    logging.info(f"Starting to create text clip for element: {element['id']}")
-    text = element.get('text', '').strip()
-    start_time = element.get('time', 0.0)
-    duration = element.get('duration')
+def resize_array(array, size):
+    """
+    Resamples a frame to the given size.
 
-    if not text:
-        logging.warning(f"Text element {element['id']} has no text content. Skipping this element.")
-        return None
+    Uses OpenCV, averaging pixel areas when shrinking and Lanczos filtering when
+    enlarging, and falls back to Pillow's Lanczos filter when OpenCV is unavailable.
 
-    font_size = parse_percentage(element.get('font_size', "5%"), min(video_width, video_height), video_height)
-    font_url = element.get('font_family')
-    font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"  # Default font
+    Args:
+        array (numpy.ndarray): A uint8 image or a float mask in [0, 1].
+        size (tuple): The target (width, height).
 
-    logging.info(f"Text content: '{text}', Font size: {font_size}, Font URL: {font_url}")
+    Returns:
+        numpy.ndarray: The resized frame, or the original if it already has that size.
+    """
+    width, height = size
+    if array.shape[1] == width and array.shape[0] == height:
+        return array
+    is_mask = array.dtype != np.uint8
+    if cv2 is not None:
+        shrinking = width * height < array.shape[0] * array.shape[1]
+        resized = cv2.resize(array, (width, height), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LANCZOS4)
+        # Lanczos overshoots around edges; keep masks within [0, 1]
+        return np.clip(resized, 0.0, 1.0) if is_mask else resized
+    if is_mask:
+        mask = Image.fromarray((array * 255).astype(np.uint8)).resize((width, height), Image.LANCZOS)
+        return np.asarray(mask) / 255.0
+    return np.asarray(Image.fromarray(array).resize((width, height), Image.LANCZOS))
+
+
+def resize_frames(clip, size):
+    """
+    Resizes every frame of a clip, and of its mask, with resize_array.
 
-    if font_url and font_url.startswith('http'):
-        try:
-            temp_font_file = download_file(font_url, suffix='.ttf')
-            if temp_font_file:
-                font_path = temp_font_file
-                logging.info(f"Successfully downloaded font: {font_path}")
-        except Exception as e:
-            logging.error(f"Error downloading font: {str(e)}")
+    Replaces MoviePy's resize effect, which goes through Pillow when it resizes. Image
+    clips are resized once rather than per frame.
 
-    try:
-        # If duration is not specified, use the remaining video duration
-        if duration is None:
-            duration = total_duration - start_time
+    Args:
+        clip (Clip): The clip to resize.
+        size (tuple): The target (width, height).
 
-        # Create a transparent image
-        img = Image.new('RGBA', (video_width, video_height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
+    Returns:
+        Clip: The resized clip.
+    """
+    return clip.fl_image(lambda frame: resize_array(frame, size), apply_to=['mask'])
 
-        # Load the font
-        font = ImageFont.truetype(font_path, font_size)
 
-        # Get text size
-        text_width, text_height = draw.textsize(text, font=font)
+# Scales libjpeg can decode at directly, largest first
+JPEG_REDUCTIONS = (8, 4, 2)
 
-        # Calculate position
-        x_percentage = element.get('x', "0%")
-        y_percentage = element.get('y', "0%")
-        x = parse_percentage(x_percentage, video_width - text_width)
-        y = parse_percentage(y_percentage, video_height - text_height)
+_CV2_REDUCED_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+} if cv2 is not None else {}
 
-        # Draw the text
-        draw.text((x, y), text, font=font, fill=element.get('fill_color', 'white'))
 
-        # Convert PIL Image to numpy array
-        img_array = np.array(img)
+def is_jpeg_file(path):
+    """
+    Checks whether a file is a JPEG by its magic bytes.
 
-        # Create ImageClip from numpy array
-        text_clip = ImageClip(img_array, transparent=True).set_duration(duration)
+    Args:
+        path (str): Path to the file.
 
-        final_clip = text_clip.set_start(start_time)
-        final_clip.name = element['id']
-        final_clip.track = element.get('track', 0)
+    Returns:
+        bool: True if the file is a JPEG.
+    """
+    with open(path, 'rb') as file:
+        return file.read(3) == b'\xff\xd8\xff'
 
-        logging.info(f"Successfully created text clip for element {element['id']}")
-        return final_clip
 
-    except Exception as e:
-        logging.error(f"Error creating text clip for element {element['id']}: {str(e)}", exc_info=True)
-        return None
-    finally:
-        if font_url and font_url.startswith('http') and os.path.exists(font_path) and font_path != "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf":
-            os.unlink(font_path)
-            logging.info(f"Cleaned up temporary font file: {font_path}")
+def jpeg_reduction(source_size, target_size):
+    """
+    Picks the largest reduced scale an image can be decoded at without ending up smaller than the target.
 
+    Args:
+        source_size (tuple): (width, height) of the image.
+        target_size (tuple): (width, height) the image will be resized to.
 
-def create_clip(element, video_width, video_height, video_spec):
+    Returns:
+        int: 8, 4 or 2 to decode at that fraction of the size, or 1 for a full decode.
     """
-    Creates a clip based on the element type.
+    for reduction in JPEG_REDUCTIONS:
+        if source_size[0] // reduction >= target_size[0] and source_size[1] // reduction >= target_size[1]:
+            return reduction
+    return 1
+
+
+def load_still_image(path, element, video_width, video_height, zoom=1.0):
+    """
+    Decodes a still image at the smallest size its layout allows and computes that layout.
+
+    Images are laid out from their header first, so a source much larger than its
+    on-screen size is decoded at a reduced scale (JPEGs) or reduced by an integer
+    factor right after decoding (other formats) instead of being kept and resampled
+    at full resolution.
 
     Args:
+        path (str): Path to the image file.
         element (dict): The JSON element.
         video_width (int): The width of the video.
         video_height (int): The height of the video.
-        video_spec (dict): The overall video specifications.
+        zoom (float): Constant zoom factor, as for compute_layout.
+
+    Returns:
+        tuple: (image array from load_image, layout from compute_layout).
+    """
+    try:
+        with Image.open(path) as header:
+            source_size = header.size
+    except (OSError, ValueError):
+        source_size = None
+    if source_size is not None:
+        layout = compute_layout(source_size, element, video_width, video_height, zoom=zoom)
+        return load_image(path, jpeg_reduction(source_size, layout[0])), layout
+    img_array = load_image(path)
+    layout = compute_layout((img_array.shape[1], img_array.shape[0]), element, video_width, video_height, zoom=zoom)
+    return img_array, layout
+
+
+def load_image(path, reduction=1):
+    """
+    Decodes a still image to an RGB or RGBA uint8 array.
+
+    OpenCV decodes straight into an array; Pillow is the fallback for formats OpenCV
+    cannot read or when OpenCV is not installed. Decoded images are kept in memory up
+    to IMAGE_CACHE_BYTES, keyed like probe_media, so logos and backgrounds reused
+    across renders are not read back from the download cache and decoded again.
+
+    Args:
+        path (str): Path to the image file.
+        reduction (int): Decode at 1/2, 1/4 or 1/8 scale (see jpeg_reduction). JPEGs
+            use libjpeg's DCT scaling; other formats are decoded in full and box-reduced
+            with Image.reduce. 1 decodes at full size.
+
+    Returns:
+        numpy.ndarray: (height, width, 3) RGB or (height, width, 4) RGBA array, read-only.
+    """
+    info = os.stat(path)
+    return _load_image(path, info.st_ino, info.st_size, reduction)
+
+
+# Total size of the decoded still images load_image keeps in memory, per render process.
+# Bounded by bytes rather than entries, since one full-resolution photo can take 50 MB.
+IMAGE_CACHE_BYTES = int(os.environ.get('IMAGE_CACHE_BYTES', 64 * 1024 * 1024))
+
+# Images decode_images decodes ahead of building the clips
+PREDECODE_IMAGES = 16
+
+_image_cache = OrderedDict()
+_image_cache_bytes = 0
+_image_cache_lock = threading.Lock()
+
+
+def _load_image(path, inode, size, reduction):
+    global _image_cache_bytes
+    key = (path, inode, size, reduction)
+    with _image_cache_lock:
+        array = _image_cache.get(key)
+        if array is not None:
+            _image_cache.move_to_end(key)
+            return array
+
+    array = _decode_image(path, reduction)
+    # Shared between renders, so nobody may modify it in place
+    array.flags.writeable = False
+    if array.nbytes > IMAGE_CACHE_BYTES:
+        return array
+    with _image_cache_lock:
+        if key not in _image_cache:
+            _image_cache[key] = array
+            _image_cache_bytes += array.nbytes
+        # Evict least recently used images until the cache fits again
+        while _image_cache_bytes > IMAGE_CACHE_BYTES:
+            _, evicted = _image_cache.popitem(last=False)
+            _image_cache_bytes -= evicted.nbytes
+    return array
+
+
+def _decode_image(path, reduction=1):
+    if reduction > 1 and not is_jpeg_file(path):
+        # Only libjpeg decodes at a reduced scale; OpenCV's reduced flags would also drop
+        # the alpha channel, so reduce the full decode by an integer factor instead
+        array = _decode_image(path)
+        return np.asarray(Image.fromarray(array).reduce(reduction))
+
+    if cv2 is not None:
+        flags = cv2.IMREAD_UNCHANGED
+        if reduction > 1:
+            # Reduced decoding applies EXIF orientation by default; full decodes do not
+            flags = _CV2_REDUCED_FLAGS[reduction] | cv2.IMREAD_IGNORE_ORIENTATION
+        array = cv2.imdecode(np.fromfile(path, dtype=np.uint8), flags)
+        if array is not None:
+            if array.dtype == np.uint16:
+                array = (array >> 8).astype(np.uint8)
+            if array.ndim == 2:
+                return cv2.cvtColor(array, cv2.COLOR_GRAY2RGB)
+            if array.shape[2] == 4:
+                return cv2.cvtColor(array, cv2.COLOR_BGRA2RGBA)
+            return cv2.cvtColor(array, cv2.COLOR_BGR2RGB)
+
+    img = Image.open(path)
+    if reduction > 1:
+        img.draft('RGB', (img.width // reduction, img.height // reduction))
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        return np.asarray(img.convert('RGBA'))
+    return np.asarray(img.convert('RGB'))
+
+
+def compute_layout(source_size, element, video_width, video_height, zoom=1.0):
+    """
+    Computes how an image or video is scaled, cropped and positioned on the canvas.
+
+    Without width, height, x and y the source covers the whole video, centered.
+    Otherwise it is scaled to cover the target box, center-cropped to it and positioned
+    by the x/y percentages. A zoom above 1 scales the source up further and crops the
+    center back to the same output size, like a constant scale animation.
+
+    Args:
+        source_size (tuple): (width, height) of the source.
+        element (dict): The JSON element.
+        video_width (int): The width of the video.
+        video_height (int): The height of the video.
+        zoom (float): Constant zoom factor applied around the center of the output.
+
+    Returns:
+        tuple: ((width, height) to scale to, (width, height, x, y) crop box in scaled
+        coordinates or None, (x, y) position of the result).
+    """
+    source_width, source_height = source_size
+    aspect_ratio = source_width / source_height
+
+    # Check if width, height, x, and y are specified
+    if all(element.get(attr) is None for attr in ['width', 'height', 'x', 'y']):
+        # If none are specified, make the image cover the entire video
+        video_aspect_ratio = video_width / video_height
+
+        if aspect_ratio > video_aspect_ratio:
+            # Image is wider, fit to height
+            new_height = video_height
+            new_width = int(new_height * aspect_ratio)
+        else:
+            # Image is taller, fit to width
+            new_width = video_width
+            new_height = int(new_width / aspect_ratio)
+
+        x_offset = (video_width - new_width) // 2
+        y_offset = (video_height - new_height) // 2
+        return _zoom_layout((new_width, new_height), None, (x_offset, y_offset), zoom)
+
+    target_width = parse_percentage(element.get('width', '100%'), video_width)
+    target_height = parse_percentage(element.get('height', '100%'), video_height)
+
+    # Resize to cover the target dimensions
+    target_ratio = target_width / target_height
+    if aspect_ratio > target_ratio:
+        new_height = target_height
+        new_width = int(new_height * aspect_ratio)
+    else:
+        new_width = target_width
+        new_height = int(new_width / aspect_ratio)
+
+    # Crop the center to the target dimensions
+    crop = (target_width, target_height, new_width / 2 - target_width / 2, new_height / 2 - target_height / 2)
+
+    # Position the result
+    final_x = parse_percentage(element.get('x', "0%"), video_width - target_width)
+    final_y = parse_percentage(element.get('y', "0%"), video_height - target_height)
+    return _zoom_layout((new_width, new_height), crop, (final_x, final_y), zoom)
+
+
+def _zoom_layout(size, crop, position, zoom):
+    """
+    Folds a constant center zoom into a layout from compute_layout.
+    """
+    if zoom <= 1.0:
+        return size, crop, position
+    output_width, output_height = (crop[0], crop[1]) if crop else size
+    zoomed_width, zoomed_height = int(size[0] * zoom), int(size[1] * zoom)
+    crop = (output_width, output_height, zoomed_width / 2 - output_width / 2, zoomed_height / 2 - output_height / 2)
+    return (zoomed_width, zoomed_height), crop, position
+
+
+def parse_scale_animations(animations, clip_duration):
+    """
+    Extracts the scale animations of an element.
+
+    Args:
+        animations (list): The element's animation dicts.
+        clip_duration (float): The duration of the clip, used when an animation has none.
+
+    Returns:
+        list: (start_scale, end_scale, start_time, end_time, easing) tuples, times relative to the clip.
+    """
+    def parse_scale(value):
+        # Unlike parse_percentage, scales above 100% are valid
+        if isinstance(value, str):
+            return float(value.strip().rstrip('%')) / 100
+        return float(value)
+
+    parsed = []
+    for anim in animations or []:
+        if anim.get('type') != 'scale':
+            continue
+        anim_start_time = anim.get('time', 0)
+        anim_end_time = anim_start_time + anim.get('duration', clip_duration)
+        start_scale = parse_scale(anim.get('start_scale', '100%'))
+        end_scale = parse_scale(anim.get('end_scale', '130%'))
+        easing = anim.get('easing', 'linear')
+        logging.info(f"Scale animation: {start_scale} -> {end_scale} from {anim_start_time}s to {anim_end_time}s ({easing})")
+        parsed.append((start_scale, end_scale, anim_start_time, anim_end_time, easing))
+    return parsed
+
+
+def scale_at(animations, t):
+    """
+    Evaluates the combined zoom factor of the scale animations at clip time t.
+    """
+    scale = 1.0
+    for start_scale, end_scale, anim_start_time, anim_end_time, easing in animations:
+        progress = min(max((t - anim_start_time) / max(anim_end_time - anim_start_time, 1e-6), 0.0), 1.0)
+        if easing == 'quadratic-out':
+            progress = 1 - (1 - progress) ** 2
+        scale *= start_scale + (end_scale - start_scale) * progress
+    return scale
+
+
+def constant_scale(animations):
+    """
+    Returns the zoom factor of scale animations that never change over time.
+
+    Args:
+        animations (list): The element's animation dicts.
+
+    Returns:
+        float or None: The combined zoom factor (at least 1, like zoompan), or None if
+        there are no scale animations or any of them changes the scale.
+    """
+    parsed = parse_scale_animations(animations, 0)
+    if parsed and all(start_scale == end_scale for start_scale, end_scale, _, _, _ in parsed):
+        return max(1.0, scale_at(parsed, 0))
+    return None
+
+
+def _zoom_expression(animations, fps):
+    """
+    Builds the FFmpeg expression equivalent to scale_at, in terms of zoompan's output frame number.
+    """
+    factors = []
+    for start_scale, end_scale, anim_start_time, anim_end_time, easing in animations:
+        progress = f"clip((on/{fps}-{anim_start_time})/{max(anim_end_time - anim_start_time, 1e-6)},0,1)"
+        if easing == 'quadratic-out':
+            progress = f"(1-pow(1-{progress},2))"
+        factors.append(f"({start_scale}+{end_scale - start_scale}*{progress})")
+    return '*'.join(factors)
+
+
+def zoom_frame(frame, scale):
+    """
+    Zooms into the center of a frame by the given factor, keeping the frame size.
+
+    Used when FFmpeg cannot pre-render a scale animation. Like zoompan, factors below 1
+    are treated as 1.
+    """
+    if scale <= 1.0:
+        return frame
+    height, width = frame.shape[:2]
+    crop_width, crop_height = max(1, int(width / scale)), max(1, int(height / scale))
+    x1, y1 = (width - crop_width) // 2, (height - crop_height) // 2
+    cropped = frame[y1:y1 + crop_height, x1:x1 + crop_width]
+    return resize_array(cropped, (width, height))
+
+
+def zoom_clip(clip, animations, duration, fps):
+    """
+    Applies scale animations to a clip frame by frame with zoom_frame.
+
+    The zoom factor of every output frame is computed once into a table, rounded to
+    three decimals. For still images, frames whose factor matches the previous frame's
+    (before and after an animation, or while it holds) reuse the previous zoomed frame
+    instead of being resampled again.
+
+    Args:
+        clip (Clip): The clip to zoom, including its mask.
+        animations (list): Scale animations from parse_scale_animations.
+        duration (float): The duration of the clip in seconds.
+        fps (int): Frame rate of the output video.
+
+    Returns:
+        Clip: The zoomed clip.
+    """
+    frame_count = int(math.ceil(duration * fps)) + 1
+    scales = np.round([scale_at(animations, index / fps) for index in range(frame_count)], 3)
+    still = isinstance(clip, ImageClip)
+
+    def zoom_filter():
+        # Each of the clip and its mask keeps its own last zoomed frame
+        last = {}
+
+        def zoom(get_frame, t):
+            scale = scales[min(int(t * fps + 1e-6), frame_count - 1)]
+            if still and last.get('scale') == scale:
+                return last['frame']
+            frame = zoom_frame(get_frame(t), scale)
+            last.update(scale=scale, frame=frame)
+            return frame
+
+        return zoom
+
+    zoomed = clip.fl(zoom_filter())
+    if clip.mask is not None:
+        zoomed.mask = clip.mask.fl(zoom_filter())
+    return zoomed
+
+
+def render_scale_animation(source_path, is_video, animations, size, crop, duration, fps, has_mask):
+    """
+    Renders a sized, cropped and zoom-animated copy of a source with FFmpeg's zoompan.
+
+    Args:
+        source_path (str): Path to the image or video source.
+        is_video (bool): Whether the source is a video rather than a still image.
+        animations (list): Scale animations from parse_scale_animations.
+        size (tuple): (width, height) the source is scaled to.
+        crop (tuple or None): (width, height, x, y) crop box in scaled coordinates.
+        duration (float): Duration to render in seconds.
+        fps (int): Frame rate of the output video.
+        has_mask (bool): Whether to keep the alpha channel.
+
+    Returns:
+        str or None: Path to the rendered clip, or None if FFmpeg failed.
+    """
+    width, height = size
+    filters = [f"fps={fps}", f"scale={width}:{height}"]
+    if crop:
+        crop_width, crop_height, crop_x, crop_y = (int(value) for value in crop)
+        filters.append(f"crop={crop_width}:{crop_height}:{crop_x}:{crop_y}")
+        width, height = crop_width, crop_height
+    filters.append(
+        f"zoompan=z='{_zoom_expression(animations, fps)}':x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+        f":d=1:s={width}x{height}:fps={fps}"
+    )
+
+    if has_mask:
+        suffix, codec = '.mov', ['-c:v', 'png', '-pix_fmt', 'rgba']
+    else:
+        # 4:4:4 has no chroma subsampling, so odd sizes are allowed
+        suffix, codec = '.mp4', ['-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18', '-pix_fmt', 'yuv444p']
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as output:
+        output_path = output.name
+
+    command = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error']
+    if not is_video:
+        command += ['-loop', '1', '-framerate', str(fps)]
+    command += ['-t', str(duration), '-i', source_path, '-vf', ','.join(filters), '-an', *codec, output_path]
+    try:
+        subprocess.run(command, check=True, stdin=subprocess.DEVNULL, capture_output=True)
+        return output_path
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.warning(f"FFmpeg zoompan failed, scaling frames with MoviePy instead: {getattr(e, 'stderr', e)}")
+        os.unlink(output_path)
+        return None
+
+
+def create_image_clip(element, video_width, video_height, total_duration, fps, source_paths=None):
+    source = element.get('source')
+    start_time = element.get('time', 0.0)
+    duration = element.get('duration')
+    speed_factor = element.get('speed', 1.0)
+    is_video = element.get('type') == 'video'
+
+    if not source:
+        logging.error(f"Image/GIF element {element['id']} has no source.")
+        return None
+
+    temp_image = local_path(source, '', source_paths)
+    if not temp_image:
+        logging.error(f"Failed to download file from {source} for element {element['id']}.")
+        return None
+
+    try:
+        # A scale animation that never changes is folded into the layout, so frames are
+        # scaled once instead of being zoomed on every rendered frame
+        constant_zoom = constant_scale(element.get('animations', []))
+        is_gif = not is_video and is_gif_file(temp_image)
+        if is_video:
+            source_infos = probe_media(temp_image)
+            source_size = tuple(source_infos['video_size'])
+            layout = compute_layout(source_size, element, video_width, video_height, zoom=constant_zoom or 1.0)
+            scaled_width, scaled_height = layout[0]
+            # Let FFmpeg scale while decoding so frames arrive at their final size, on NVDEC when available
+            clip = decode_video(temp_image, _detect_hwaccel(), (scaled_width, scaled_height))
+        elif is_gif:
+            # FFmpeg decodes, loops and retimes the GIF at the output frame rate, scaling it while
+            # decoding; MoviePy only reads the finished frames from the pipe
+            with Image.open(temp_image) as gif:
+                gif_size = gif.size
+            layout = compute_layout(gif_size, element, video_width, video_height, zoom=constant_zoom or 1.0)
+            # Decoded with alpha, so transparent pixels are masked as on the FFmpeg path
+            clip = decode_video(temp_image, target_size=layout[0], loop=True, speed=speed_factor, fps=fps, alpha=True)
+        else:
+            # Handle static image (including transparent PNGs)
+            img_array, layout = load_still_image(temp_image, element, video_width, video_height, zoom=constant_zoom or 1.0)
+            img_array = resize_array(img_array, layout[0])
+            # The color channels of RGBA images are passed as views; nothing downstream needs them contiguous
+            if img_array.shape[2] == 4 and img_array[:, :, 3].min() == 255:
+                # An alpha channel that is opaque everywhere needs no mask, so the layer is
+                # copied rather than alpha-blended on every frame
+                clip = ImageClip(img_array[:, :, :3])
+            elif img_array.shape[2] == 4:
+                # Scaled straight from the alpha plane into float32, half the size of a float64 mask
+                mask = np.multiply(img_array[:, :, 3], 1.0 / 255.0, dtype=np.float32)
+                clip = ImageClip(img_array[:, :, :3])
+                # Assigned directly; set_mask would copy the freshly built clip
+                clip.mask = ImageClip(mask, ismask=True)
+            else:
+                clip = ImageClip(img_array)
+
+        # Set clip duration and start time
+        place_clip(clip, start_time, duration or clip.duration)
+
+        (new_width, new_height), layer_crop, layer_position = layout
+
+        resized_clip = clip if clip.size == (new_width, new_height) else resize_frames(clip, (new_width, new_height))
+        if layer_crop:
+            # Crop to fit the target dimensions
+            crop_width, crop_height, crop_x, crop_y = layer_crop
+            final_clip = resized_clip.crop(x1=crop_x, y1=crop_y, width=crop_width, height=crop_height)
+        else:
+            final_clip = resized_clip
+        place_clip(final_clip, start_time, position=layer_position)
+
+        # Handle animations
+        clip_duration = clip.duration or (total_duration - start_time)
+        animations = [] if constant_zoom else parse_scale_animations(element.get('animations', []), clip_duration)
+        if animations and is_gif:
+            logging.warning(f"Scale animations are not supported for GIF element {element['id']}; ignoring them.")
+            animations = []
+
+        layer_path = temp_image
+        animated = False
+        if animations:
+            has_mask = final_clip.mask is not None
+            rendered = render_scale_animation(
+                temp_image, is_video, animations, (new_width, new_height), layer_crop, clip_duration, fps, has_mask
+            )
+            if rendered:
+                # The decoded clip is replaced by the render, so stop its FFmpeg decoder now;
+                # nothing would close it once the clip is dropped
+                reader = getattr(clip, 'reader', None)
+                if isinstance(reader, FFmpegPipeReader):
+                    reader.close()
+                # FFmpeg's zoompan did the per-frame scaling; MoviePy only reads the result
+                animated_clip = VideoFileClip(rendered, has_mask=has_mask)
+                animated_clip.audio_path = getattr(final_clip, 'audio_path', None)
+                final_clip = place_clip(animated_clip, start_time, position=layer_position)
+                final_clip.temp_file = rendered
+                layer_path, new_width, new_height, layer_crop = rendered, final_clip.w, final_clip.h, None
+                animated = True
+            else:
+                final_clip = zoom_clip(final_clip, animations, clip_duration, fps)
+
+        final_clip.name = element['id']
+        final_clip.track = element.get('track', 0)
+
+        # Images, videos and GIFs can be composited by FFmpeg without rendering frames in
+        # Python; speed only retimes GIFs, on either path
+        if animated or not animations:
+            layer_kind = 'gif' if is_gif else 'video' if is_video or animated else 'image'
+            # FFmpeg's GIF decoder keeps transparency, so GIF layers are always blended with alpha
+            layer_alpha = is_gif or final_clip.mask is not None
+            source_duration = final_clip.duration if animated else source_infos['duration'] if is_video else 0
+            final_clip.ffmpeg_layer = {
+                'path': layer_path,
+                'kind': layer_kind,
+                'alpha': layer_alpha,
+                'size': (new_width, new_height),
+                'crop': layer_crop,
+                'position': layer_position,
+                'audio_path': getattr(final_clip, 'audio_path', None),
+                'speed': speed_factor if is_gif else 1.0,
+                # Opaque, uncropped videos that outlast their element need no CPU-only filters,
+                # so their NVDEC frames can stay in GPU memory all the way to NVENC
+                'device_frames': (
+                    layer_kind == 'video' and not layer_alpha and layer_crop is None
+                    and final_clip.duration is not None and final_clip.duration <= source_duration
+                ),
+            }
+
+        clip_kind = 'video' if is_video else 'GIF' if is_gif else 'image'
+        logging.info(f"Created {clip_kind} clip for element {element['id']} positioned at {layer_position} with size {final_clip.w}x{final_clip.h}.")
+        return final_clip
+
+    except Exception as e:
+        logging.error(f"Error creating image/GIF clip for element {element['id']}: {e}")
+        return None
+
+
+@functools.lru_cache(maxsize=64)
+def load_font(font_path, font_size):
+    """
+    Loads a TrueType font, memoized because text elements commonly share fonts and sizes.
+
+    Args:
+        font_path (str): Path to the font file.
+        font_size (int): The font size in pixels.
+
+    Returns:
+        ImageFont.FreeTypeFont: The loaded font.
+    """
+    return ImageFont.truetype(font_path, font_size)
+
+
+@functools.lru_cache(maxsize=256)
+def render_text(text, font_path, font_size, fill):
+    """
+    Rasterizes text onto a transparent canvas just large enough to hold it.
+
+    Memoized because captions and titles are often repeated across renders. The canvas
+    is converted to an array once here, so cache hits hand the same buffer straight to
+    ImageClip instead of copying the image again.
+
+    Args:
+        text (str): The text to draw.
+        font_path (str): Path to the TrueType font.
+        font_size (int): The font size in pixels.
+        fill (str): The text color.
+
+    Returns:
+        numpy.ndarray: The (height, width, 4) RGBA text image, read-only.
+    """
+    font = load_font(font_path, font_size)
+    # Measured straight from the font rather than through a scratch image and textsize
+    if '\n' in text:
+        _, _, width, height = ImageDraw.Draw(Image.new('RGBA', (1, 1))).multiline_textbbox((0, 0), text, font=font)
+    else:
+        _, _, width, height = font.getbbox(text)
+    img = Image.new('RGBA', (max(1, width), max(1, height)), (0, 0, 0, 0))
+    ImageDraw.Draw(img).text((0, 0), text, font=font, fill=fill)
+    array = np.asarray(img)
+    # Shared between renders, so nobody may modify it in place
+    array.flags.writeable = False
+    return array
+
+
+def create_text_clip(element, video_width, video_height, total_duration, source_paths=None):
+    logging.info(f"Starting to create text clip for element: {element['id']}")
+    text = element.get('text', '').strip()
+    start_time = element.get('time', 0.0)
+    duration = element.get('duration')
+
+    if not text:
+        logging.warning(f"Text element {element['id']} has no text content. Skipping this element.")
+        return None
+
+    # vmin font sizes are relative to the shorter side, like percentages
+    font_size = parse_percentage(element.get('font_size', "5%"), min(video_width, video_height), min(video_width, video_height))
+    font_url = element.get('font_family')
+    font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"  # Default font
+
+    logging.info(f"Text content: '{text}', Font size: {font_size}, Font URL: {font_url}")
+
+    if font_url and font_url.startswith('http'):
+        try:
+            temp_font_file = local_path(font_url, '.ttf', source_paths)
+            if temp_font_file:
+                font_path = temp_font_file
+                logging.info(f"Successfully downloaded font: {font_path}")
+        except Exception as e:
+            logging.error(f"Error downloading font: {str(e)}")
+
+    try:
+        # If duration is not specified, use the remaining video duration
+        if duration is None:
+            duration = total_duration - start_time
+
+        # Rasterize only the text itself rather than a full-frame canvas
+        text_array = render_text(text, font_path, font_size, element.get('fill_color', 'white'))
+        text_height, text_width = text_array.shape[:2]
+
+        # Calculate position
+        x_percentage = element.get('x', "0%")
+        y_percentage = element.get('y', "0%")
+        x = parse_percentage(x_percentage, video_width - text_width)
+        y = parse_percentage(y_percentage, video_height - text_height)
+
+        # Create ImageClip from the RGBA text, using its alpha as the mask
+        final_clip = place_clip(ImageClip(text_array, transparent=True), start_time, duration, position=(x, y))
+        final_clip.name = element['id']
+        final_clip.track = element.get('track', 0)
+
+        # Saved as a PNG so FFmpeg can overlay the text without MoviePy rendering frames
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as layer_file:
+            Image.fromarray(text_array).save(layer_file, format='PNG', compress_level=1)
+        final_clip.temp_file = layer_file.name
+        final_clip.ffmpeg_layer = {
+            'path': layer_file.name,
+            'kind': 'image',
+            'alpha': True,
+            'size': (text_width, text_height),
+            'crop': None,
+            'position': (x, y),
+            'audio_path': None,
+            'speed': 1.0,
+            'device_frames': False,
+        }
+
+        logging.info(f"Successfully created text clip for element {element['id']}")
+        return final_clip
+
+    except Exception as e:
+        logging.error(f"Error creating text clip for element {element['id']}: {str(e)}", exc_info=True)
+        return None
+
+
+def create_clip(element, video_width, video_height, video_spec, source_paths=None):
+    """
+    Creates a clip based on the element type.
+
+    Args:
+        element (dict): The JSON element.
+        video_width (int): The width of the video.
+        video_height (int): The height of the video.
+        video_spec (dict): The overall video specifications.
+        source_paths (dict): Prefetched paths from prefetch_sources, or None.
 
     Returns:
         Clip or None: The created clip or None if failed.
     """
     element_type = element.get('type')
     if element_type == 'audio':
-        return create_audio_clip(element)
+        return create_audio_clip(element, source_paths)
     elif element_type in ['image', 'video']:
-        return create_image_clip(element, video_width, video_height)
+        return create_image_clip(element, video_width, video_height, video_spec.get('duration', 15.0), video_spec.get('fps', 30), source_paths)
     elif element_type == 'text':
-        return create_text_clip(element, video_width, video_height, video_spec.get('duration', 15.0))
+        return create_text_clip(element, video_width, video_height, video_spec.get('duration', 15.0), source_paths)
     else:
-        print(f"Unknown element type: {element_type}")
+        logging.warning(f"Unknown element type: {element_type}")
         return None
 
 
+# Fields of a layer that determine the filtergraph; source paths only appear in the inputs
+LAYER_SHAPE_FIELDS = ('kind', 'alpha', 'size', 'crop', 'position', 'speed', 'device_frames', 'start', 'duration')
+
+# Fields of an audio track that determine the filtergraph
+AUDIO_SHAPE_FIELDS = ('start', 'volume')
+
+
+def _layer_shape(layers):
+    """
+    Reduces layers to the hashable shape key used to cache their filtergraph.
+    """
+    return tuple(tuple(layer[field] for field in LAYER_SHAPE_FIELDS) for layer in layers)
+
+
+def _audio_shape(audio_tracks):
+    """
+    Reduces audio tracks to the hashable shape key used to cache their filtergraph.
+    """
+    return tuple(tuple(track[field] for field in AUDIO_SHAPE_FIELDS) for track in audio_tracks)
+
+
+@functools.lru_cache(maxsize=512)
+def _build_filtergraph(shape, video_width, video_height, gpu):
+    """
+    Builds an FFmpeg filter_complex that overlays the layers.
+
+    Input 0 is the black background and layer i is input i. On the GPU layers are
+    scaled with scale_cuda (or on the CPU when they carry an alpha channel, which
+    scale_cuda cannot keep) and blended with overlay_cuda; layers decoded into device
+    memory skip the upload and every CPU filter. Otherwise the same graph runs with the
+    CPU scale and overlay filters. Either way frames never enter Python. Clients reuse
+    the same canvas sizes and layouts with different sources, so graphs are cached by shape.
+
+    Args:
+        shape (tuple): The layer shape from _layer_shape.
+        video_width (int): The width of the video.
+        video_height (int): The height of the video.
+        gpu (bool): Whether to composite with the CUDA filters.
+
+    Returns:
+        str: The filtergraph, whose output is labelled [vout].
+    """
+    base = f"[0:v]scale={video_width}:{video_height},format=yuv420p"
+    graph = [base + (",hwupload_cuda[base0]" if gpu else "[base0]")]
+    overlay = "overlay_cuda" if gpu else "overlay"
+    for index, (kind, alpha, size, crop, position, speed, device_frames, start, duration) in enumerate(shape, start=1):
+        scaled_width, scaled_height = size
+        x, y = position
+        if gpu and device_frames:
+            # NVDEC frames are nv12; overlay_cuda needs them in the base's yuv420p
+            chain = [f"trim=duration={duration}", f"setpts=PTS-STARTPTS+{start}/TB", f"scale_cuda={scaled_width}:{scaled_height}:format=yuv420p"]
+            graph.append(f"[{index}:v]{','.join(chain)}[layer{index}]")
+            graph.append(f"[base{index - 1}][layer{index}]overlay_cuda=x={int(x)}:y={int(y)}:eof_action=pass[base{index}]")
+            continue
+
+        chain = []
+        if crop:
+            # The crop box is given in scaled coordinates; crop the source before scaling
+            crop_width, crop_height, crop_x, crop_y = crop
+            chain.append(
+                f"crop=w=iw*{crop_width / scaled_width:.6f}:h=ih*{crop_height / scaled_height:.6f}"
+                f":x=iw*{crop_x / scaled_width:.6f}:y=ih*{crop_y / scaled_height:.6f}"
+            )
+            scaled_width, scaled_height = crop_width, crop_height
+        if speed != 1.0:
+            chain.append(f"setpts=PTS/{speed}")
+        if kind in ('video', 'gif'):
+            # Hold the last frame if the source is shorter than the element, like MoviePy does
+            chain.append(f"tpad=stop_mode=clone:stop_duration={duration}")
+            chain.append(f"trim=duration={duration}")
+        chain.append(f"setpts=PTS-STARTPTS+{start}/TB")
+        if not gpu:
+            chain += [f"scale={scaled_width}:{scaled_height}", "format=yuva420p" if alpha else "format=yuv420p"]
+        elif alpha:
+            chain += [f"scale={scaled_width}:{scaled_height}", "format=yuva420p", "hwupload_cuda"]
+        else:
+            chain += ["format=yuv420p", "hwupload_cuda", f"scale_cuda={scaled_width}:{scaled_height}"]
+        graph.append(f"[{index}:v]{','.join(chain)}[layer{index}]")
+        graph.append(f"[base{index - 1}][layer{index}]{overlay}=x={int(x)}:y={int(y)}:eof_action=pass[base{index}]")
+
+    graph[-1] = graph[-1].rsplit('[', 1)[0] + '[vout]'
+    return ';'.join(graph)
+
+
+@functools.lru_cache(maxsize=512)
+def _build_audio_filtergraph(shape, first_input):
+    """
+    Builds an FFmpeg filter_complex that mixes the audio tracks.
+
+    Each track is delayed to its start time and scaled by its volume, then all tracks
+    are summed without normalization, like MoviePy's CompositeAudioClip.
+
+    Args:
+        shape (tuple): The audio shape from _audio_shape.
+        first_input (int): The FFmpeg input index of the first track.
+
+    Returns:
+        str: The filtergraph, whose output is labelled [aout].
+    """
+    graph = []
+    for index, (start, volume) in enumerate(shape):
+        delay = int(start * 1000)
+        graph.append(f"[{first_input + index}:a]asetpts=PTS-STARTPTS,volume={volume},adelay=delays={delay}:all=1[audio{index}]")
+    inputs = ''.join(f"[audio{index}]" for index in range(len(shape)))
+    graph.append(f"{inputs}amix=inputs={len(shape)}:duration=longest:normalize=0[aout]")
+    return ';'.join(graph)
+
+
+def _timed_layer(clip, layer, video_duration):
+    start = clip.start or 0
+    duration = clip.duration if clip.duration is not None else video_duration - start
+    return dict(layer, start=start, duration=min(duration, video_duration - start))
+
+
+def get_soundtrack_layers(video_clips, video_duration):
+    """
+    Collects the layers of the video clips that carry a soundtrack, for get_ffmpeg_audio.
+
+    Used when the frames are composited by MoviePy, so the soundtracks are still mixed
+    by FFmpeg together with the audio elements, exactly as on the filter_complex path.
+
+    Args:
+        video_clips (list): The video clips.
+        video_duration (float): The duration of the video in seconds.
+
+    Returns:
+        list: The layers with start and duration resolved.
+    """
+    layers = []
+    for clip in video_clips:
+        audio_path = getattr(clip, 'audio_path', None)
+        if audio_path:
+            layers.append(_timed_layer(clip, {'audio_path': audio_path}, video_duration))
+    return layers
+
+
+def soundtrack_clips(soundtrack_layers):
+    """
+    Opens the soundtracks of video layers as audio clips, for mixing by MoviePy.
+
+    Args:
+        soundtrack_layers (list): The layers from get_soundtrack_layers.
+
+    Returns:
+        list: AudioFileClips placed at their layers' start and duration.
+    """
+    clips = []
+    for layer in soundtrack_layers:
+        clip = AudioFileClip(layer['audio_path'])
+        clips.append(place_clip(clip, layer['start'], min(layer['duration'], clip.duration)))
+    return clips
+
+
+def get_ffmpeg_layers(video_clips, video_duration):
+    """
+    Collects the FFmpeg layer descriptions of the clips, in compositing order.
+
+    Args:
+        video_clips (list): The sorted video clips.
+        video_duration (float): The duration of the video in seconds.
+
+    Returns:
+        list or None: The layers with start and duration resolved, or None if any clip
+        has to be rendered by MoviePy (animations FFmpeg could not pre-render).
+    """
+    layers = []
+    for clip in video_clips:
+        layer = getattr(clip, 'ffmpeg_layer', None)
+        if layer is None:
+            return None
+        layers.append(_timed_layer(clip, layer, video_duration))
+    return layers or None
+
+
+def get_ffmpeg_audio(layers, audio_clips, video_duration):
+    """
+    Collects the audio tracks to mix: audio elements and the soundtracks of video layers.
+
+    Args:
+        layers (list): The layers from get_ffmpeg_layers.
+        audio_clips (list): The audio clips.
+        video_duration (float): The duration of the video in seconds.
+
+    Returns:
+        list or None: Track dicts with path, start, duration and volume, or None if an
+        audio clip cannot be mixed by FFmpeg.
+    """
+    tracks = []
+    for layer in layers:
+        if layer.get('audio_path'):
+            tracks.append({'path': layer['audio_path'], 'start': layer['start'], 'duration': layer['duration'], 'volume': 1.0})
+    for clip in audio_clips:
+        track = getattr(clip, 'ffmpeg_audio', None)
+        if track is None:
+            return None
+        start = clip.start or 0
+        if start >= video_duration:
+            continue
+        duration = min(track['duration'], video_duration - start) if track['duration'] else video_duration - start
+        tracks.append(dict(track, start=start, duration=duration))
+    return tracks
+
+
+# Audio codecs MP4 can carry as-is
+COPYABLE_AUDIO_CODECS = ('aac', 'mp3')
+
+
+def audio_codec(path):
+    """
+    Returns the codec name of a file's first audio stream, or None if it cannot be probed.
+
+    Memoized per file like probe_media.
+    """
+    info = os.stat(path)
+    return _stream_codec(path, info.st_ino, info.st_size, 'a:0')
+
+
+def video_codec(path):
+    """
+    Returns the codec name of a file's first video stream, or None if it cannot be probed.
+
+    Memoized per file like probe_media.
+    """
+    info = os.stat(path)
+    return _stream_codec(path, info.st_ino, info.st_size, 'v:0')
+
+
+@functools.lru_cache(maxsize=256)
+def _stream_codec(path, inode, size, stream):
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', stream,
+             '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', path],
+            capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.warning(f"Could not probe the codec of stream {stream} of {path}: {e}")
+        return None
+    return result.stdout.strip() or None
+
+
+# Pseudo encoder name for timelines whose single source is copied into the output without re-encoding
+COPY_ENCODER = 'copy'
+
+
+def can_copy_video(layers, audio_tracks, video_width, video_height, video_fps):
+    """
+    Checks whether the timeline is a single H.264 video that can be stream-copied as the output.
+
+    That is the case when the only layer is an opaque video that fills the canvas
+    unscaled from the start, at the output frame rate and for no longer than the source
+    lasts, and the only audio is its own unmodified AAC or MP3 soundtrack, if any.
+
+    Args:
+        layers (list): The layers from get_ffmpeg_layers.
+        audio_tracks (list): The audio tracks from get_ffmpeg_audio.
+        video_width (int): The width of the video.
+        video_height (int): The height of the video.
+        video_fps (int): Frames per second of the output.
+
+    Returns:
+        bool: True if the source can be copied.
+    """
+    if len(layers) != 1:
+        return False
+    layer = layers[0]
+    if (
+        layer['kind'] != 'video' or layer['alpha'] or layer['crop'] or layer['start']
+        or layer['speed'] != 1.0 or tuple(layer['size']) != (video_width, video_height)
+        or tuple(layer['position']) != (0, 0)
+    ):
+        return False
+    if audio_tracks and (
+        len(audio_tracks) != 1 or audio_tracks[0]['path'] != layer['path']
+        or audio_tracks[0]['start'] or audio_tracks[0]['volume'] != 1.0
+        or audio_codec(layer['path']) not in COPYABLE_AUDIO_CODECS
+    ):
+        return False
+    infos = probe_media(layer['path'])
+    return (
+        tuple(infos['video_size']) == (video_width, video_height)
+        and abs(infos['video_fps'] - video_fps) < 0.01
+        and layer['duration'] <= infos['video_duration']
+        and video_codec(layer['path']) == 'h264'
+    )
+
+
+def _composite_command(layers, audio_tracks, video_width, video_height, video_duration, video_fps, encoder, streaming=False):
+    """
+    Builds the FFmpeg command that composites, mixes and encodes the timeline, without output options.
+
+    The CUDA filters are used when encoding with NVENC on a host with CUDA, otherwise
+    the CPU filters feed the given encoder. With COPY_ENCODER the single source is
+    copied instead, see can_copy_video.
+    """
+    if encoder == COPY_ENCODER:
+        # Checked by can_copy_video: one video layer, at most its own audio
+        command = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', layers[0]['path'], '-map', '0:v:0']
+        command += ['-map', '0:a:0'] if audio_tracks else ['-an']
+        return command + ['-c', 'copy', '-t', str(video_duration)]
+
+    gpu = encoder == 'h264_nvenc' and _detect_hwaccel() == 'cuda'
+    command = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error']
+    if gpu:
+        command += ['-init_hw_device', 'cuda=cu', '-filter_hw_device', 'cu']
+    command += ['-f', 'lavfi', '-i', f"color=c=black:s={video_width}x{video_height}:r={video_fps}:d={video_duration}"]
+    for layer in layers:
+        if layer['kind'] == 'image':
+            command += ['-loop', '1', '-framerate', str(video_fps)]
+        elif layer['kind'] == 'gif':
+            # GIFs loop for as long as their element lasts, like the MoviePy GIF clips
+            command += ['-stream_loop', '-1']
+        elif gpu and layer['device_frames']:
+            command += ['-hwaccel', 'cuda', '-hwaccel_device', 'cu', '-hwaccel_output_format', 'cuda']
+        # A sped up GIF reads proportionally more of its (looped) source
+        command += ['-t', str(layer['duration'] * layer['speed']), '-i', layer['path']]
+    # A single unmodified AAC or MP3 track is copied into the output instead of being decoded and re-encoded
+    copy_audio = (
+        len(audio_tracks) == 1 and audio_tracks[0]['volume'] == 1.0
+        and audio_codec(audio_tracks[0]['path']) in COPYABLE_AUDIO_CODECS
+    )
+    for track in audio_tracks:
+        if copy_audio:
+            command += ['-itsoffset', str(track['start'])]
+        command += ['-t', str(track['duration']), '-i', track['path']]
+
+    filtergraph = _build_filtergraph(_layer_shape(layers), video_width, video_height, gpu)
+    if audio_tracks and not copy_audio:
+        filtergraph += ';' + _build_audio_filtergraph(_audio_shape(audio_tracks), len(layers) + 1)
+
+    command += ['-filter_complex', filtergraph, '-map', '[vout]']
+    if copy_audio:
+        command += ['-map', f"{len(layers) + 1}:a:0", '-c:a', 'copy']
+    elif audio_tracks:
+        command += ['-map', '[aout]', '-c:a', 'aac']
+    command += [
+        '-c:v', encoder, *encoder_params(encoder, streaming),
+        '-threads', str(ENCODE_THREADS),
+        '-r', str(video_fps),
+        '-t', str(video_duration),
+    ]
+    return command
+
+
+def composite_with_ffmpeg(layers, audio_tracks, video_width, video_height, video_duration, video_fps, output_path, encoder):
+    """
+    Composites, mixes and encodes the timeline in a single FFmpeg invocation.
+
+    Args:
+        layers (list): Layer dicts as produced for each clip's ffmpeg_layer.
+        audio_tracks (list): Audio tracks from get_ffmpeg_audio.
+        video_width (int): The width of the video.
+        video_height (int): The height of the video.
+        video_duration (float): The duration of the video in seconds.
+        video_fps (int): Frames per second of the output.
+        output_path (str): Path of the output file.
+        encoder (str): The FFmpeg encoder name (e.g. "h264_nvenc" or "libx264"), or COPY_ENCODER.
+
+    Raises:
+        subprocess.CalledProcessError: If FFmpeg fails.
+    """
+    command = _composite_command(layers, audio_tracks, video_width, video_height, video_duration, video_fps, encoder)
+    command += ['-movflags', '+faststart', output_path]
+
+    logging.info(f"Compositing {len(layers)} layers and {len(audio_tracks)} audio tracks with FFmpeg ({encoder})")
+    subprocess.run(command, check=True, stdin=subprocess.DEVNULL, capture_output=True)
+
+
+def stream_composite_with_ffmpeg(layers, audio_tracks, video_width, video_height, video_duration, video_fps, upload_url, encoder):
+    """
+    Composites the timeline with FFmpeg and streams the encoded MP4 straight to the upload URL.
+
+    The output is a fragmented MP4, which needs no seek back to write the moov atom, so
+    FFmpeg's stdout is uploaded as it is produced and nothing is written to disk.
+
+    Args:
+        layers (list): Layer dicts as produced for each clip's ffmpeg_layer.
+        audio_tracks (list): Audio tracks from get_ffmpeg_audio.
+        video_width (int): The width of the video.
+        video_height (int): The height of the video.
+        video_duration (float): The duration of the video in seconds.
+        video_fps (int): Frames per second of the output.
+        upload_url (str): Presigned URL accepting a chunked PUT of the video; only used
+            when the request sets stream_upload.
+        encoder (str): The FFmpeg encoder name (e.g. "h264_nvenc" or "libx264"), or COPY_ENCODER.
+
+    Returns:
+        str: The URL of the uploaded video.
+
+    Raises:
+        subprocess.CalledProcessError: If FFmpeg fails.
+        requests.RequestException: If the upload fails, e.g. because the server does
+            not accept chunked bodies.
+    """
+    command = _composite_command(layers, audio_tracks, video_width, video_height, video_duration, video_fps, encoder, streaming=True)
+    command += ['-movflags', '+frag_keyframe+empty_moov', '-f', 'mp4', 'pipe:1']
+
+    logging.info(f"Compositing {len(layers)} layers and {len(audio_tracks)} audio tracks with FFmpeg ({encoder}), streaming to the upload URL")
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            video_url = upload_video(process.stdout, upload_url)
+        except Exception:
+            # Stop FFmpeg from blocking on a pipe nobody reads anymore
+            process.kill()
+            raise
+        finally:
+            process.wait()
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr.read())
+    return video_url
+
+
+def upload_video(data, upload_url=None):
+    """
+    Uploads an encoded video.
+
+    Args:
+        data (file-like): The video bytes, read until EOF; a regular file when posting to 0x0.st.
+        upload_url (str): Presigned URL to PUT the video to. If None, the video is posted to 0x0.st.
+
+    Returns:
+        str: The public URL of the uploaded video.
+
+    Raises:
+        requests.RequestException: If the upload URL rejects the video or the upload
+            stalls for longer than UPLOAD_TIMEOUT.
+    """
+    if upload_url:
+        response = requests.put(upload_url, data=data, headers={'Content-Type': 'video/mp4'}, timeout=UPLOAD_TIMEOUT)
+        response.raise_for_status()
+        # Drop the signature so the webhook gets the plain object URL
+        return upload_url.split('?', 1)[0]
+
+    if MultipartEncoder is not None:
+        # Streams the file in chunks instead of building the whole multipart body in memory
+        body = MultipartEncoder(fields={'file': ('video.mp4', data, 'video/mp4')})
+        response = requests.post('https://0x0.st', data=body, headers={'Content-Type': body.content_type}, timeout=UPLOAD_TIMEOUT)
+    else:
+        response = requests.post('https://0x0.st', files={'file': data}, timeout=UPLOAD_TIMEOUT)
+    return response.text.strip()
+
+
+def blit_into(frame, clip, t):
+    """
+    Draws a clip's frame at time t onto the frame in place, blending with its mask.
+
+    Unlike MoviePy's blit_on, which copies the whole background and converts it back
+    to uint8 for every clip, only the region the clip covers is touched.
+
+    Args:
+        frame (numpy.ndarray): The (height, width, 3) uint8 frame to draw on.
+        clip (Clip): The clip to draw, playing at time t.
+        t (float): The time in the composite, in seconds.
+    """
+    clip_time = t - clip.start
+    position = clip.pos(clip_time)
+    if clip.relative_pos or not all(isinstance(value, (int, float, np.number)) for value in position):
+        # Named and relative positions are resolved by MoviePy
+        np.copyto(frame, clip.blit_on(frame, t))
+        return
+
+    picture = clip.get_frame(clip_time)
+    x, y = int(position[0]), int(position[1])
+    picture_height, picture_width = picture.shape[:2]
+    x1, y1 = max(0, -x), max(0, -y)
+    x2, y2 = min(picture_width, frame.shape[1] - x), min(picture_height, frame.shape[0] - y)
+    if x1 >= x2 or y1 >= y2:
+        return
+    region = frame[y + y1:y + y2, x + x1:x + x2]
+    source = picture[y1:y2, x1:x2]
+    if clip.mask is None:
+        region[...] = source
+    else:
+        alpha = clip.mask.get_frame(clip_time)[y1:y2, x1:x2, np.newaxis]
+        region[...] = region + alpha * (source.astype(np.float32) - region)
+
+
+def buffered_composite_frame(clips, size):
+    """
+    Builds a make_frame for a CompositeVideoClip that draws every frame into one reused buffer.
+
+    The writer encodes each frame before asking for the next, so a single
+    preallocated frame replaces the fresh full-size arrays MoviePy allocates per
+    frame and per layer.
+
+    Args:
+        clips (list): The composite's clips, in compositing order.
+        size (tuple): (width, height) of the composite.
+
+    Returns:
+        function: make_frame(t) returning the shared (height, width, 3) uint8 frame.
+    """
+    width, height = size
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+
+    def make_frame(t):
+        # Black background, like CompositeVideoClip with bg_color=None
+        frame.fill(0)
+        for clip in clips:
+            if clip.is_playing(t):
+                blit_into(frame, clip, t)
+        return frame
+
+    return make_frame
+
+
+def write_final_video(final_video, output_path, fps, encoder, audio_tracks=None):
+    """
+    Encodes the composed video to a file with the given H.264 encoder.
+
+    Args:
+        final_video (Clip): The composed clip to encode.
+        output_path (str): Path of the output file.
+        fps (int): Frames per second of the output.
+        encoder (str): The FFmpeg encoder name (e.g. "h264_nvenc" or "libx264").
+        audio_tracks (list, optional): Audio tracks from get_ffmpeg_audio. When given they
+            are mixed by FFmpeg with amix instead of rendering the clip's audio in MoviePy.
+
+    Raises:
+        OSError: If FFmpeg fails to encode the video.
+    """
+    width, height = final_video.size
+
+    logging.info(f"Encoding video with {encoder} using {ENCODE_THREADS} threads")
+
+    audio_path = None
+    command = [
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{width}x{height}", '-r', str(fps), '-i', 'pipe:0',
+    ]
+    try:
+        if audio_tracks:
+            for track in audio_tracks:
+                command += ['-t', str(track['duration']), '-i', track['path']]
+            command += [
+                '-filter_complex', _build_audio_filtergraph(_audio_shape(audio_tracks), 1),
+                '-map', '0:v', '-map', '[aout]', '-c:a', 'aac', '-t', str(final_video.duration),
+            ]
+        elif final_video.audio is not None:
+            # Next to the output, so concurrent renders never share an audio file
+            audio_path = os.path.splitext(output_path)[0] + '-audio.m4a'
+            final_video.audio.write_audiofile(audio_path, fps=44100, codec='aac', logger=None)
+            command += ['-i', audio_path, '-map', '0:v', '-map', '1:a', '-c:a', 'copy']
+        command += [
+            '-c:v', encoder, *encoder_params(encoder),
+            '-threads', str(ENCODE_THREADS),
+            '-movflags', '+faststart',
+            '-flags:v', '+global_header',
+            # NVENC converts RGB to YUV on the GPU itself, so frames only get a cheap
+            # repack to bgr0 on the CPU instead of a full swscale conversion
+            '-vf', 'format=bgr0' if encoder == 'h264_nvenc' else 'format=yuv420p',
+            output_path,
+        ]
+
+        # Frames are written to FFmpeg's stdin as they are made, without MoviePy's writer
+        # or a per-frame tobytes() copy
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr, bufsize=FRAME_PIPE_BUFFER
+            )
+            try:
+                for frame in final_video.iter_frames(fps=fps, dtype='uint8'):
+                    process.stdin.write(np.ascontiguousarray(frame).data)
+            except BrokenPipeError:
+                # FFmpeg exited early; its error is reported below
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+                process.wait()
+            if process.returncode != 0:
+                stderr.seek(0)
+                raise OSError(f"FFmpeg failed to encode the video with {encoder}: {stderr.read().decode(errors='replace')}")
+    finally:
+        if audio_path and os.path.exists(audio_path):
+            os.unlink(audio_path)
+
+
+def iter_elements(spec):
+    """
+    Yields the elements of a video or composition, flattening nested compositions.
+
+    Elements of a composition are yielded as copies whose time is offset by the
+    composition's start; the spec itself is not modified.
+
+    Args:
+        spec (dict): The video specification or a composition element.
+
+    Yields:
+        dict: The non-composition elements.
+    """
+    offset = spec.get('time') or 0 if spec.get('type') == 'composition' else 0
+    for element in spec.get('elements') or []:
+        if offset:
+            element = dict(element, time=(element.get('time') or 0) + offset)
+        if element.get('type') == 'composition':
+            yield from iter_elements(element)
+        else:
+            yield element
+
+
+def content_duration(clips, video_duration):
+    """
+    Returns how long the video has to be to show all of its clips.
+
+    A clip without an end (e.g. a still image without a duration) lasts until the end
+    of the video, so the video is only shortened when every clip ends before it.
+
+    Args:
+        clips (list): The video and audio clips.
+        video_duration (float): The duration of the video in seconds.
+
+    Returns:
+        float: The end of the last clip, or video_duration if any clip runs to the end.
+    """
+    ends = [clip.end for clip in clips]
+    if not ends or any(end is None for end in ends):
+        return video_duration
+    content_end = max(ends)
+    return content_end if 0 < content_end < video_duration else video_duration
+
+
 def generate_video(json_data):
     """
     Generates a video based on the provided JSON configuration.
@@ -533,13 +2214,17 @@ def generate_video(json_data):
     Returns:
         str or None: The URL of the uploaded video or None if failed.
     """
+    video_clips = []
+    audio_clips = []
+    pin_dir = None
     try:
         video_spec = json_data
-        video_clips = []
-        audio_clips = []
 
         logging.info("Starting video generation process...")
-        logging.info(f"Video specification: {json.dumps(video_spec, indent=2)}")
+        # Serializing the spec is only worth it when debug logs are actually emitted
+        debug_logging = logging.getLogger().isEnabledFor(logging.DEBUG)
+        if debug_logging:
+            logging.debug(f"Video specification: {json.dumps(video_spec, indent=2)}")
 
         # Set default values if not provided
         video_duration = video_spec.get('duration', 15.0)
@@ -549,9 +2234,25 @@ def generate_video(json_data):
 
         logging.info(f"Video settings: duration={video_duration}, fps={video_fps}, width={video_width}, height={video_height}")
 
-        for index, element in enumerate(video_spec['elements']):
-            logging.info(f"Processing element {index + 1}/{len(video_spec['elements'])}: {json.dumps(element, indent=2)}")
-            clip = create_clip(element, video_width, video_height, video_spec)
+        # Flatten compositions and order the timeline once; clips are built, and
+        # therefore layered, in this order
+        elements = sorted(iter_elements(video_spec), key=lambda e: (e.get('track') or 0, e.get('time') or 0))
+        if debug_logging:
+            for element in elements:
+                logging.debug(f"Processing element: {json.dumps(element, indent=2)}")
+
+        # Fetch every remote asset concurrently, then build the clips one by one from the cache.
+        # Only the I/O runs in parallel: MoviePy clips are not safe to build from several
+        # threads (readers, temp files and ImageMagick calls share state), and once the
+        # downloads are prefetched building a clip is cheap, so a clip thread pool only added risk
+        # The files stay pinned until the render ends, so other renders' downloads cannot
+        # evict them between the prefetch and the final encode
+        pin_dir = create_pin_dir()
+        source_paths = prefetch_sources(elements, pin_dir)
+        decode_images(elements, source_paths, video_width, video_height)
+
+        for index, element in enumerate(elements):
+            clip = create_clip(element, video_width, video_height, video_spec, source_paths)
             if clip:
                 if isinstance(clip, AudioFileClip):
                     audio_clips.append(clip)
@@ -562,94 +2263,122 @@ def generate_video(json_data):
             else:
                 logging.warning(f"Failed to create clip for element: {element['id']}")
             
-            # Force garbage collection after each element
-            gc.collect()
+            # Collect garbage every few elements; a full collection per element costs more than it frees
+            if index % GC_INTERVAL == GC_INTERVAL - 1:
+                gc.collect()
             
-            # Log memory usage
-            process = psutil.Process(os.getpid())
-            logging.info(f"Memory usage after processing element {index + 1}: {process.memory_info().rss / 1024 / 1024:.2f} MB")
+            # Log memory usage; reading it is a syscall per element, so only when debugging
+            if debug_logging:
+                logging.debug(f"Memory usage after processing element {index + 1}: {_process.memory_info().rss / 1024 / 1024:.2f} MB")
 
         logging.info(f"Total video/image/GIF/text clips created: {len(video_clips)}")
         logging.info(f"Total audio clips created: {len(audio_clips)}")
 
-        if video_clips or audio_clips:
-            # Sort video clips based on track number and start time
-            video_clips.sort(key=lambda c: (getattr(c, 'track', 0), getattr(c, 'start', 0)))
-            logging.info("Sorted video/image/GIF/text clips based on track number and start time")
+        # Don't encode filler frames past the end of the content
+        content_end = content_duration(video_clips + audio_clips, video_duration)
+        if content_end < video_duration:
+            logging.info(f"Content ends at {content_end}s; shortening the video from {video_duration}s")
+            video_duration = content_end
 
+        if video_clips or audio_clips:
+            # Presigned upload target; without one the video is uploaded to 0x0.st
+            upload_url = video_spec.get('upload_url')
+            # Streaming needs a server that accepts chunked PUTs, so it is opt-in per request
+            stream_upload = bool(upload_url) and video_spec.get('stream_upload', False)
+            temp_file_path = None
             try:
-                logging.info("Creating CompositeVideoClip...")
-                # Create the final composite video
-                final_video = CompositeVideoClip(video_clips, size=(video_width, video_height), bg_color=None).set_duration(video_duration)
-                logging.info("Created CompositeVideoClip with all video/image/GIF/text clips")
-
-                # Combine audio clips
-                if audio_clips:
-                    logging.info("Creating CompositeAudioClip...")
-                    composite_audio = CompositeAudioClip(audio_clips)
-                    final_video = final_video.set_audio(composite_audio)
-                    logging.info("Added CompositeAudioClip to the final video")
-
-                # Upload video to 0x0.st instead of exporting as a file
+                # Timelines FFmpeg can express are composited by a single filter_complex;
+                # MoviePy only renders the rest. Hardware encoders fall back to libx264.
+                layers = get_ffmpeg_layers(video_clips, video_duration)
+                audio_tracks = get_ffmpeg_audio(layers, audio_clips, video_duration) if layers else None
+                encoders = list(dict.fromkeys([_detect_encoder(), SOFTWARE_ENCODER])) if audio_tracks is not None else []
+                if encoders and can_copy_video(layers, audio_tracks, video_width, video_height, video_fps):
+                    # A lone full-frame H.264 video needs no compositing or encoding at all
+                    encoders.insert(0, COPY_ENCODER)
+
+                if encoders and stream_upload:
+                    try:
+                        video_url = stream_composite_with_ffmpeg(layers, audio_tracks, video_width, video_height, video_duration, video_fps, upload_url, encoders[0])
+                        logging.info(f"Streamed video to {video_url}")
+                        return video_url
+                    except subprocess.CalledProcessError as e:
+                        logging.warning(f"FFmpeg compositing with {encoders[0]} failed: {e.stderr}")
+                        encoders = encoders[1:]
+                    except requests.RequestException as e:
+                        # The server rejected the chunked body (e.g. 411 or 501) despite
+                        # stream_upload; render to a file instead and upload it with a Content-Length
+                        logging.warning(f"Streaming upload failed, uploading from a file instead: {e}")
+
                 with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_file:
-                    logging.info(f"Writing video to temporary file: {temp_file.name}")
-                    
-                    # Set permissions for the temporary video file
-                    os.chmod(temp_file.name, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
-                    
-                    # Get the number of CPU cores
-                    num_cores = multiprocessing.cpu_count()
-
-                    # Prepare FFmpeg parameters for software encoding
-                    ffmpeg_params = [
-                        "-preset", "ultrafast",
-                        "-crf", "23",
-                        "-tune", "fastdecode,zerolatency",
-                        "-movflags", "+faststart",
-                        "-bf", "0",
-                        "-flags:v", "+global_header",
-                        "-vf", "format=yuv420p",
-                        "-maxrate", "4M",
-                        "-bufsize", "4M",
-                        "-threads", str(num_cores)
-                    ]
-
-                    logging.info("Using software encoding with libx264")
-
-                    # Use write_videofile with software encoding settings
-                    final_video.write_videofile(
-                        temp_file.name,
-                        fps=video_fps,
-                        codec="libx264",
-                        audio_codec="aac",
-                        temp_audiofile='temp-audio.m4a',
-                        remove_temp=True,
-                        logger='bar',
-                        ffmpeg_params=ffmpeg_params
-                    )
                     temp_file_path = temp_file.name
-                
-                # Upload the video to 0x0.st
+                logging.info(f"Writing video to temporary file: {temp_file_path}")
+
+                # Set permissions for the temporary video file
+                os.chmod(temp_file_path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
+
+                composited = False
+                for encoder in encoders:
+                    try:
+                        composite_with_ffmpeg(layers, audio_tracks, video_width, video_height, video_duration, video_fps, temp_file_path, encoder)
+                        composited = True
+                        break
+                    except subprocess.CalledProcessError as e:
+                        logging.warning(f"FFmpeg compositing with {encoder} failed: {e.stderr}")
+
+                if not composited:
+                    logging.info("Falling back to MoviePy compositing")
+                    logging.info("Creating CompositeVideoClip...")
+                    # Create the final composite video
+                    final_video = CompositeVideoClip(video_clips, size=(video_width, video_height), bg_color=None)
+                    if final_video.duration != video_duration:
+                        final_video = final_video.set_duration(video_duration)
+                    final_video.make_frame = buffered_composite_frame(final_video.clips, (video_width, video_height))
+                    logging.info("Created CompositeVideoClip with all video/image/GIF/text clips")
+
+                    # Audio elements are mixed with the soundtracks of the video clips, as on the
+                    # FFmpeg path. FFmpeg mixes them with amix while encoding; MoviePy only mixes
+                    # when a track cannot be handed over.
+                    soundtrack_layers = get_soundtrack_layers(video_clips, video_duration)
+                    fallback_audio = get_ffmpeg_audio(soundtrack_layers, audio_clips, video_duration)
+                    if fallback_audio is not None:
+                        logging.info(f"Mixing {len(fallback_audio)} audio tracks with FFmpeg")
+                    else:
+                        logging.info("Creating CompositeAudioClip...")
+                        # Only now are the video soundtracks opened; they are closed with the audio clips
+                        audio_clips = soundtrack_clips(soundtrack_layers) + audio_clips
+                        final_video = final_video.set_audio(CompositeAudioClip(audio_clips))
+                        logging.info("Added CompositeAudioClip to the final video")
+
+                    encoder = _detect_encoder()
+                    try:
+                        write_final_video(final_video, temp_file_path, video_fps, encoder, fallback_audio)
+                    except OSError as e:
+                        if encoder == SOFTWARE_ENCODER:
+                            raise
+                        # Hardware sessions are limited (e.g. 2-3 concurrent NVENC sessions on
+                        # consumer cards), so retry in software instead of failing the request.
+                        logging.warning(f"Encoding with {encoder} failed, falling back to {SOFTWARE_ENCODER}: {e}")
+                        write_final_video(final_video, temp_file_path, video_fps, SOFTWARE_ENCODER, fallback_audio)
+
+                # Upload the video to the presigned URL or 0x0.st
                 try:
-                    logging.info("Uploading video to 0x0.st...")
+                    logging.info("Uploading video...")
                     with open(temp_file_path, 'rb') as file:
-                        response = requests.post('https://0x0.st', files={'file': file})
-                    video_url = response.text.strip()
-                    logging.info(f"Uploaded video to 0x0.st: {video_url}")
+                        video_url = upload_video(file, upload_url)
+                    logging.info(f"Uploaded video: {video_url}")
                     return video_url
                 except Exception as e:
-                    logging.error(f"Failed to upload video to 0x0.st: {e}")
+                    logging.error(f"Failed to upload video: {e}")
                     return None
-                finally:
-                    # Clean up the temporary file
-                    os.unlink(temp_file_path)
-                    logging.info(f"Cleaned up temporary file: {temp_file_path}")
 
             except Exception as e:
                 logging.error(f"Error creating or writing the final video: {str(e)}", exc_info=True)
-                if os.path.exists(temp_file.name):
-                    os.unlink(temp_file.name)
                 return None
+            finally:
+                # Clean up the temporary file
+                if temp_file_path and os.path.exists(temp_file_path):
+                    os.unlink(temp_file_path)
+                    logging.info(f"Cleaned up temporary file: {temp_file_path}")
         else:
             logging.error("Error: No valid clips were created.")
             return None
@@ -659,4 +2388,127 @@ def generate_video(json_data):
         return None
     except Exception as e:
         logging.error(f"An unexpected error occurred during video generation: {str(e)}", exc_info=True)
-        return None
\ No newline at end of file
+        return None
+    finally:
+        # Video and audio sources are read until the final encode finishes, so release them last
+        for clip in video_clips + audio_clips:
+            cleanup_clip(clip)
+        if pin_dir:
+            release_pin_dir(pin_dir)
+
+# Cache file suffix of each kind of source; images and videos are recognized by content
+SOURCE_SUFFIXES = {'audio': '.mp3', 'font': '.ttf'}
+
+
+def prefetch_source(url, element_type, pin_dir=None):
+    """
+    Downloads a source or font into the cache and, for videos, probes it.
+
+    Args:
+        url (str): The source URL.
+        element_type (str): The element type the source belongs to, or "font".
+        pin_dir (str): Optional pin directory from create_pin_dir; the file is pinned
+            there so it cannot be evicted before the render has finished with it.
+
+    Returns:
+        str or None: The path to the cached file or None if the download failed.
+    """
+    suffix = SOURCE_SUFFIXES.get(element_type, '')
+    path = download_file(url, suffix=suffix)
+    if path and pin_dir and not pin_file(path, pin_dir):
+        # Evicted by another render between the download and the pin; fetch it again
+        path = download_file(url, suffix=suffix)
+        if path and not pin_file(path, pin_dir):
+            path = None
+    if path and element_type == 'video':
+        try:
+            probe_media(path)
+        except Exception as e:
+            logging.warning(f"Failed to probe {url}: {e}")
+    return path
+
+
+def prefetch_sources(elements, pin_dir=None):
+    """
+    Downloads the sources and fonts of the elements concurrently, each distinct URL once.
+
+    Args:
+        elements (list): The JSON elements.
+        pin_dir (str): Optional pin directory from create_pin_dir to pin the files in.
+
+    Returns:
+        dict: Path of each source by (url, suffix), or None if its download failed, for the
+        create_*_clip functions.
+    """
+    sources = set()
+    for element in elements:
+        if element.get('source'):
+            sources.add((element['source'], element.get('type')))
+        font_url = element.get('font_family')
+        if element.get('type') == 'text' and font_url and font_url.startswith('http'):
+            sources.add((font_url, 'font'))
+    if not sources:
+        return {}
+    sources = list(sources)
+    logging.info(f"Fetching {len(sources)} assets")
+    paths = _download_executor.map(lambda source: prefetch_source(*source, pin_dir=pin_dir), sources)
+    return {
+        (url, SOURCE_SUFFIXES.get(element_type, '')): path
+        for (url, element_type), path in zip(sources, paths)
+    }
+
+
+def decode_image(path, element, video_width, video_height):
+    """
+    Decodes a still image into load_image's cache, skipping GIFs, which are decoded frame by frame.
+
+    Args:
+        path (str): Path to the downloaded source.
+        element (dict): The image element, whose layout decides the decode scale.
+        video_width (int): The width of the video.
+        video_height (int): The height of the video.
+    """
+    try:
+        if not is_gif_file(path):
+            load_still_image(path, element, video_width, video_height, zoom=constant_scale(element.get('animations', [])) or 1.0)
+    except Exception as e:
+        logging.warning(f"Failed to decode {path}: {e}")
+
+
+def decode_images(elements, source_paths, video_width, video_height):
+    """
+    Decodes the still images of the elements concurrently, ahead of building the clips.
+
+    Clips are built serially, but decoding is the expensive part of an image clip and
+    OpenCV releases the GIL while it decodes, so the download threads decode the images
+    in parallel and create_image_clip then finds them in load_image's cache.
+
+    Args:
+        elements (list): The JSON elements.
+        source_paths (dict): Paths from prefetch_sources.
+        video_width (int): The width of the video.
+        video_height (int): The height of the video.
+    """
+    images = {}
+    for element in elements:
+        if element.get('type') == 'image' and element.get('source'):
+            path = source_paths.get((element['source'], ''))
+            if path:
+                images.setdefault(path, element)
+    images = list(images.items())[:PREDECODE_IMAGES]
+    if images:
+        list(_download_executor.map(lambda image: decode_image(*image, video_width, video_height), images))
+
+
+def prefetch_batch(json_datas):
+    """
+    Downloads the union of the sources of several videos that share source files.
+
+    Run once before the batch's renders are started, so they hit the download cache
+    instead of fetching the same files concurrently.
+
+    Args:
+        json_datas (list): The JSON configurations.
+    """
+    logging.info(f"Prefetching the sources of {len(json_datas)} videos in one batch")
+    prefetch_sources([element for json_data in json_datas for element in iter_elements(json_data)])
@@ -1,76 +1,335 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import httpx
+import msgspec
+import functools
+import hashlib
+import json
+import shutil
 import subprocess
 import os
 import random
+import secrets
 import string
 import time
 import logging
 
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.environ.get('J2V_LOG', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Hardware H.264 encoders in order of preference, with settings giving roughly the
+# quality of libx264 at CRF 28; libx264 is the software fallback
+COMPRESS_HW_ENCODERS = {
+    'h264_nvenc': ('-preset', 'p5', '-rc', 'vbr', '-cq', '28', '-b:v', '0'),
+    'h264_amf': ('-usage', 'transcoding', '-quality', 'balanced', '-rc', 'cqp', '-qp_i', '24', '-qp_p', '26'),
+    'h264_qsv': ('-global_quality', '28'),
+}
+COMPRESS_SOFTWARE_ENCODER = 'libx264'
+COMPRESS_SOFTWARE_PARAMS = (
+    '-crf', '28',  # Increase compression (lower quality, smaller file size)
+    # veryslow's exhaustive motion search costs many times the encode time for a few
+    # percent smaller files at CRF 28
+    '-preset', 'medium',
+    '-threads', '0',
+)
+COMPRESS_OUTPUT_ARGS = (
+    '-acodec', 'aac',
+    '-b:a', '96k',
+    '-vf', 'scale=720:-2',  # Reduce resolution to 720p
+)
+
+# The moov atom goes to the front so players can start and seek without fetching the
+# end of the file first
+COMPRESS_FILE_ARGS = ('-movflags', '+faststart')
+
+# The encoder-dependent part of the compress_video command, built once per encoder
+_COMPRESS_ENCODE_ARGS = {
+    encoder: ('-vcodec', encoder, *params, *COMPRESS_OUTPUT_ARGS)
+    for encoder, params in {**COMPRESS_HW_ENCODERS, COMPRESS_SOFTWARE_ENCODER: COMPRESS_SOFTWARE_PARAMS}.items()
+}
+
+@functools.lru_cache(maxsize=1)
+def detect_compress_encoder():
+    """
+    Detects the fastest usable H.264 encoder for compress_video.
+
+    The encoders compiled into FFmpeg are listed once and each hardware candidate is
+    verified with a tiny test encode, since an encoder can be built in without the
+    matching device being present. The result is cached for the life of the process.
+    Setting J2V_ENCODER skips detection, for deployments that know their hardware.
+
+    Returns:
+        str: The name of the encoder to use.
+    """
+    override = os.environ.get('J2V_ENCODER')
+    if override in _COMPRESS_ENCODE_ARGS:
+        logging.info(f"Compressing with encoder from J2V_ENCODER: {override}")
+        return override
+    if override:
+        logging.warning(f"Ignoring unsupported J2V_ENCODER {override}")
+
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True, timeout=10)
+        available = result.stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.warning(f"Could not list FFmpeg encoders, using {COMPRESS_SOFTWARE_ENCODER}: {e}")
+        return COMPRESS_SOFTWARE_ENCODER
+
+    for encoder in COMPRESS_HW_ENCODERS:
+        if encoder not in available:
+            continue
+        try:
+            probe = subprocess.run(
+                ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+                 '-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1',
+                 '-c:v', encoder, '-f', 'null', '-'],
+                capture_output=True, timeout=10
+            )
+        except (OSError, subprocess.SubprocessError):
+            continue
+        if probe.returncode == 0:
+            logging.info(f"Compressing with hardware encoder: {encoder}")
+            return encoder
+
+    logging.info(f"No hardware encoder available, compressing with {COMPRESS_SOFTWARE_ENCODER}")
+    return COMPRESS_SOFTWARE_ENCODER
+
+def _compress_command(input_path, output_path, encoder, output_args=()):
+    # -y because a failed hardware attempt may have left a partial output behind; only
+    # errors are logged, so FFmpeg's progress output never fills a pipe or the server log
+    return (
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', input_path, *_COMPRESS_ENCODE_ARGS[encoder], *output_args, output_path,
+    )
+
+# Videos at most this wide, encoded in H.264 at no more than this bitrate, are already
+# as small as compress_video would make them and are passed through unchanged
+COMPRESS_SKIP_MAX_WIDTH = 720
+COMPRESS_SKIP_MAX_BITRATE = 1_500_000
+
+def _probe_video(input_path):
+    """
+    Reads the video codec, width and overall bitrate of a file with ffprobe.
+
+    Returns:
+        tuple or None: (codec name, width, bit rate in bits/s), or None if the file
+        cannot be probed.
+    """
+    try:
+        output = subprocess.check_output(
+            ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-select_streams', 'v:0',
+             '-show_entries', 'stream=codec_name,width:format=bit_rate', input_path],
+            timeout=30
+        )
+        info = json.loads(output)
+        stream = info['streams'][0]
+        return stream['codec_name'], int(stream['width']), int(info['format']['bit_rate'])
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError, IndexError) as e:
+        logging.warning(f"Could not probe {input_path}: {e}")
+        return None
+
+def _run_ffmpeg(command):
+    # stderr is captured so a failure carries FFmpeg's error message
+    subprocess.run(command, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
 
 def compress_video(input_path, output_path):
-    command = [
-        'ffmpeg',
-        '-i', input_path,
-        '-vcodec', 'libx264',
-        '-crf', '28',  # Increase compression (lower quality, smaller file size)
-        '-preset', 'veryslow',  # Use a slower preset for better compression
-        '-acodec', 'aac',
-        '-strict', 'experimental',
-        '-vf', 'scale=720:-2',  # Reduce resolution to 720p
-        output_path
-    ]
-    subprocess.run(command, check=True)
+    probe = _probe_video(input_path)
+    if probe is not None:
+        codec, width, bit_rate = probe
+        if codec == 'h264' and width <= COMPRESS_SKIP_MAX_WIDTH and bit_rate <= COMPRESS_SKIP_MAX_BITRATE:
+            logging.info(f"{input_path} is already {width}px wide at {bit_rate // 1000} kb/s, skipping compression")
+            try:
+                os.link(input_path, output_path)
+            except OSError:
+                shutil.copyfile(input_path, output_path)
+            return
+
+    encoder = detect_compress_encoder()
+    try:
+        _run_ffmpeg(_compress_command(input_path, output_path, encoder, COMPRESS_FILE_ARGS))
+    except subprocess.CalledProcessError as e:
+        if encoder == COMPRESS_SOFTWARE_ENCODER:
+            raise
+        # Hardware sessions are limited, so retry in software instead of failing
+        logging.warning(f"Compressing with {encoder} failed, falling back to {COMPRESS_SOFTWARE_ENCODER}: {e.stderr}")
+        _run_ffmpeg(_compress_command(input_path, output_path, COMPRESS_SOFTWARE_ENCODER, COMPRESS_FILE_ARGS))
+
+RANDOM_STRING_ALPHABET = string.ascii_letters + string.digits
 
 def generate_random_string(length=4):
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+    # secrets draws from the OS RNG; the alphabet stays letters and digits only
+    return ''.join(secrets.choice(RANDOM_STRING_ALPHABET) for _ in range(length))
+
+# Shared across uploads so retries and later uploads reuse pooled keep-alive connections.
+# Only failed connection attempts are retried here: a streamed body cannot be replayed,
+# so upload_to_0x0 retries whole uploads itself, reopening the file each time.
+upload_session = requests.Session()
+upload_session.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=Retry(total=3, connect=3, read=0, status=0, backoff_factor=1)))
+
+# (connect, read) timeouts in seconds for uploads
+UPLOAD_TIMEOUT = (5, 300)
+
+# Chunk size for reading files to hash them
+HASH_CHUNK_SIZE = 1 << 20
+
+def _0x0_video_url(response_text):
+    original_url = response_text.strip()
+    # Extract the random part from the original URL
+    random_part = original_url.split('/')[-1].split('.')[0]
+    return f"https://0x0.st/{random_part}.mp4"
+
+def _retry_delay(attempt, response=None):
+    """
+    Returns how long to wait before retrying a failed upload.
+
+    Exponential backoff with up to a second of jitter, so workers that failed together
+    do not retry together; a numeric Retry-After from the server takes precedence.
+    """
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(60, int(retry_after))
+    return 2 ** attempt + random.uniform(0, 1)
+
+# URLs of files already uploaded by this process, keyed by (path, size, mtime) and
+# holding the SHA-256 of the uploaded content along with the URL
+UPLOAD_CACHE_SIZE = 256
+_upload_cache = {}
+
+def _file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class _HashingReader:
+    """
+    Wraps a file so everything read from it is hashed, so an upload computes the
+    digest of the file as it sends it instead of reading it a second time.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        chunk = self.file.read(size)
+        self.digest.update(chunk)
+        return chunk
+
+    # The multipart encoder takes the remaining body length from fstat and tell
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+def _cached_upload(key, file_path):
+    """
+    Returns the URL the file was uploaded to, if it is unchanged and still being served.
+
+    Only a file whose path, size and modification time match an earlier upload is
+    hashed, to confirm its content did not change. 0x0.st expires files, so the URL is
+    then confirmed with a HEAD request, which costs a round trip instead of a full upload.
+    """
+    entry = _upload_cache.get(key)
+    if entry is None:
+        return None
+    digest, url = entry
+    try:
+        if _file_digest(file_path) == digest and upload_session.head(url, timeout=UPLOAD_TIMEOUT[0]).status_code == 200:
+            return url
+    except (OSError, requests.RequestException):
+        pass
+    _upload_cache.pop(key, None)
+    return None
+
+def _remember_upload(key, digest, url):
+    if len(_upload_cache) >= UPLOAD_CACHE_SIZE:
+        # Dicts keep insertion order, so this drops the oldest upload
+        _upload_cache.pop(next(iter(_upload_cache)), None)
+    _upload_cache[key] = (digest, url)
+
+# 0x0.st rejects files larger than this, but only after receiving the whole body
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 512 * 1024 * 1024))
+
+def _check_upload_size(file_path):
+    # One stat() instead of a connection and a round trip the server would reject
+    info = os.stat(file_path)
+    if info.st_size == 0:
+        raise ValueError(f"Refusing to upload empty file: {file_path}")
+    if info.st_size > UPLOAD_MAX_BYTES:
+        raise ValueError(f"Refusing to upload {file_path}: {info.st_size} bytes exceeds the {UPLOAD_MAX_BYTES} byte limit")
+    return info
 
 def upload_to_0x0(file_path, max_retries=3):
+    info = _check_upload_size(file_path)
+    key = (os.path.realpath(file_path), info.st_size, info.st_mtime_ns)
     for attempt in range(max_retries):
+        # Also checked before each retry, in case a concurrent upload of the same file succeeded
+        url = _cached_upload(key, file_path)
+        if url:
+            logging.info(f"{file_path} was already uploaded to {url}")
+            return url
         try:
             with open(file_path, 'rb') as file:
-                response = requests.post('https://0x0.st', files={'file': file})
+                reader = _HashingReader(file)
+                if MultipartEncoder is not None:
+                    # Streams the file in chunks instead of building the whole multipart body in memory
+                    body = MultipartEncoder(fields={'file': (os.path.basename(file_path), reader, 'video/mp4')})
+                    response = upload_session.post('https://0x0.st', data=body, headers={'Content-Type': body.content_type}, timeout=UPLOAD_TIMEOUT)
+                else:
+                    response = upload_session.post('https://0x0.st', files={'file': (os.path.basename(file_path), reader)}, timeout=UPLOAD_TIMEOUT)
             
             if response.status_code == 200:
-                original_url = response.text.strip()
-                # Extract the random part from the original URL
-                random_part = original_url.split('/')[-1].split('.')[0]
-                modified_url = f"https://0x0.st/{random_part}.mp4"
-                return modified_url
+                url = _0x0_video_url(response.text)
+                # The server received the whole body, so the digest covers the whole file
+                _remember_upload(key, reader.digest.hexdigest(), url)
+                return url
             else:
-                print(f"Upload attempt {attempt + 1} failed. Status code: {response.status_code}")
+                logging.warning(f"Upload attempt {attempt + 1} failed. Status code: {response.status_code}")
                 if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)  # Exponential backoff
+                    time.sleep(_retry_delay(attempt, response))
                 else:
                     raise Exception(f"Failed to upload file after {max_retries} attempts.")
         except requests.RequestException as e:
-            print(f"Upload attempt {attempt + 1} failed due to network error: {str(e)}")
+            logging.warning(f"Upload attempt {attempt + 1} failed due to network error: {str(e)}")
             if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)  # Exponential backoff
+                time.sleep(_retry_delay(attempt))
             else:
                 raise Exception(f"Failed to upload file after {max_retries} attempts due to network errors.")
 
-def send_webhook(webhook_url, video_url):
+async def send_webhook(client, webhook_url, video_url):
     """
     Sends a webhook with the video URL.
 
     Args:
+        client (httpx.AsyncClient): The shared client, which keeps connections alive across webhooks.
         webhook_url (str): The URL to send the webhook to.
         video_url (str): The URL of the generated video.
 
     Returns:
-        bool: True if the webhook was sent successfully, False otherwise.
+        bool: True if the webhook was sent successfully.
+
+    Raises:
+        httpx.HTTPError: If the webhook could not be delivered, so the caller can decide
+            whether to retry.
     """
     try:
         payload = {
             "video_url": video_url
         }
-        response = requests.post(webhook_url, json=payload)
+        # Serialized with msgspec's C encoder, already used to decode requests
+        response = await client.post(webhook_url, content=msgspec.json.encode(payload), headers={'Content-Type': 'application/json'})
         response.raise_for_status()
         logging.info(f"Webhook sent successfully to {webhook_url}")
         return True
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"Error sending webhook: {str(e)}")
-        return False
+        raise
@@ -0,0 +1,48 @@
+from arq.connections import RedisSettings
+from .main import (
+    REDIS_URL,
+    RENDER_WORKERS,
+    close_http_client,
+    init_gpu_semaphore,
+    init_http_client,
+    load_video_generator,
+    process_video_request_with_timeout,
+)
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Configure logging
+logging.basicConfig(level=os.environ.get('J2V_LOG', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
+
+async def generate_video_task(ctx, json_data: dict, webhook_url: str):
+    """
+    Generates a video and delivers the webhook for a queued request.
+
+    The worker is long-lived, so its render processes keep MoviePy, FFmpeg probes and
+    the encoder detection cache warm across jobs. Rendering runs in the worker's
+    process pool, like the API's, since MoviePy frame making is GIL-bound and
+    concurrent jobs would otherwise share one interpreter.
+    """
+    logging.info(f"Starting queued video generation job {ctx['job_id']}")
+    await process_video_request_with_timeout(json_data, webhook_url, executor=ctx['process_pool'])
+
+async def startup(ctx):
+    # One render process per concurrent job, each importing MoviePy before the first job arrives
+    ctx['process_pool'] = ProcessPoolExecutor(max_workers=RENDER_WORKERS, initializer=load_video_generator)
+    init_gpu_semaphore()
+    init_http_client()
+
+async def shutdown(ctx):
+    await close_http_client()
+    ctx['process_pool'].shutdown()
+
+class WorkerSettings:
+    # Run with: arq app.worker.WorkerSettings
+    functions = [generate_video_task]
+    on_startup = startup
+    on_shutdown = shutdown
+    redis_settings = RedisSettings.from_dsn(REDIS_URL or 'redis://localhost:6379')
+    # Same concurrency as the API's local ProcessPoolExecutor
+    max_jobs = RENDER_WORKERS
+    job_timeout = 600
@@ -0,0 +1,29 @@
+from types import SimpleNamespace
+
+import pytest
+
+video_generator = pytest.importorskip("app.video_generator")
+
+
+def clip(start, end):
+    return SimpleNamespace(start=start, end=end)
+
+
+def test_content_duration_keeps_video_for_image_without_duration():
+    # A background image without a duration plus a 3 s voiceover
+    clips = [clip(0, None), clip(0, 3.03)]
+    assert video_generator.content_duration(clips, 10) == 10
+
+
+def test_content_duration_shortens_to_last_clip_end():
+    clips = [clip(0, 4), clip(1, 6.5)]
+    assert video_generator.content_duration(clips, 10) == 6.5
+
+
+def test_content_duration_never_extends_video():
+    clips = [clip(0, 12)]
+    assert video_generator.content_duration(clips, 10) == 10
+
+
+def test_content_duration_without_clips():
+    assert video_generator.content_duration([], 10) == 10